@@ -0,0 +1,85 @@
+"""GET /lots/ and a large /static photo through the ASGI AuthMiddleware vs a BaseHTTPMiddleware equivalent.
+
+    python benchmarks/auth_middleware.py [requests]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="bench-auth-")
+sys.path.insert(0, ROOT)
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(WORKDIR, 'bench.sqlite')}"
+os.environ["STATIC_DIR"] = os.path.join(WORKDIR, "static")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-" + "x" * 24)
+
+import httpx  # noqa: E402
+from fastapi import FastAPI, HTTPException, Request, status  # noqa: E402
+from fastapi.staticfiles import StaticFiles  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.responses import JSONResponse  # noqa: E402
+
+from data.config import create_tables, new_session, STATIC_DIR  # noqa: E402
+from models.user import LoginRequest  # noqa: E402
+from service import user as user_service  # noqa: E402
+from tools.аuthMiddleware import AuthMiddleware, oauth2_scheme  # noqa: E402
+from web import lot  # noqa: E402
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+PHOTO_SIZE = 4 << 20
+
+
+class BaseHTTPAuthMiddleware(BaseHTTPMiddleware):
+    # what AuthMiddleware replaced: every response goes through an extra task and memory stream
+    async def dispatch(self, request: Request, call_next):
+        if request.method == "OPTIONS" or request.url.path in ["/user/login", "/user/register", "/docs",
+                                                               "/openapi.json"]:
+            return await call_next(request)
+        try:
+            token = await oauth2_scheme(request)
+            async with new_session() as session:
+                request.state.user_id = await user_service.verify_token_user_id(session, token)
+        except HTTPException:
+            return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED, content={"detail": "Invalid Token..."})
+        return await call_next(request)
+
+
+def build_app(middleware) -> FastAPI:
+    app = FastAPI()
+    app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+    app.add_middleware(middleware)
+    app.include_router(lot.router)
+    return app
+
+
+async def timed(client: httpx.AsyncClient, path: str, headers: dict, count: int) -> float:
+    await client.get(path, headers=headers)
+    started = time.perf_counter()
+    for _ in range(count):
+        response = await client.get(path, headers=headers)
+        assert response.status_code == 200, response.status_code
+    return (time.perf_counter() - started) / count * 1000
+
+
+async def main():
+    os.makedirs(os.path.join(STATIC_DIR, "images"), exist_ok=True)
+    with open(os.path.join(STATIC_DIR, "images", "big.jpg"), "wb") as photo:
+        photo.write(os.urandom(PHOTO_SIZE))
+    await create_tables()
+    credentials = LoginRequest(email="bench@example.com", password="secret")
+    async with new_session() as session:
+        await user_service.register(session, credentials)
+        token = (await user_service.login(session, credentials))["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    for name, middleware in (("BaseHTTPMiddleware", BaseHTTPAuthMiddleware), ("ASGI", AuthMiddleware)):
+        transport = httpx.ASGITransport(app=build_app(middleware))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for path, count in (("/lots/", REQUESTS), ("/static/images/big.jpg", max(REQUESTS // 10, 1))):
+                print(f"{name:20s} GET {path:24s} {await timed(client, path, headers, count):.2f} ms/req")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""Concurrent writers and readers on one SQLite file: default engine vs data.config.build_engine.
+
+    python benchmarks/db_write_contention.py [writers] [commits_per_writer]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="bench-db-")
+DB_PATH = os.path.join(WORKDIR, "bench.sqlite")
+sys.path.insert(0, ROOT)
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # noqa: E402
+
+from data import config  # noqa: E402
+from data.config import Base, EntryOrm, LotOrm, UserOrm, MicrogreenOrm  # noqa: E402
+
+WRITERS = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+COMMITS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+READERS = 10
+READS = 40
+
+
+def reset_database():
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+
+
+async def bench(name: str, engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with sessions() as session:
+        session.add(MicrogreenOrm(id=1, name="basil", days_to_grow=7, temperature="", light="", avatar=""))
+        session.add(UserOrm(id=1, email="bench@example.com", hashed_password="x"))
+        session.add(LotOrm(id=1, user_id=1, microgreen_id=1, sowing_date=datetime.now(), substrate_type="soil",
+                           expected_harvest_date=datetime.now()))
+        await session.commit()
+
+    errors = 0
+
+    async def writer():
+        nonlocal errors
+        for _ in range(COMMITS):
+            try:
+                async with sessions() as session:
+                    session.add(EntryOrm(lot_id=1, entry_date=datetime.now(), description="d", photo_url="p",
+                                         height=1, moisture=1))
+                    await session.commit()
+            except Exception:
+                # "database is locked" on the default engine
+                errors += 1
+
+    async def reader():
+        for _ in range(READS):
+            async with sessions() as session:
+                await session.execute(text("SELECT count(*) FROM entries"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer() for _ in range(WRITERS)), *(reader() for _ in range(READERS)))
+    elapsed = time.perf_counter() - started
+    commits = WRITERS * COMMITS
+    print(f"{name:8s} {commits} commits + {READERS * READS} reads: {elapsed:.2f}s "
+          f"({(commits - errors) / elapsed:.0f} commits/s, {errors} failed)")
+    await engine.dispose()
+
+
+async def main():
+    reset_database()
+    await bench("default", create_async_engine(config.DATABASE_URL))
+    reset_database()
+    await bench("profile", config.build_engine(config.DATABASE_URL))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
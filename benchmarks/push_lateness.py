@@ -0,0 +1,103 @@
+"""Push delivery lateness and idle database load: the timer heap vs the old fixed one-minute poll.
+
+    python benchmarks/push_lateness.py [timer|poll] [idle_seconds]
+
+"poll" stands in for the scheduler before the timer heap (check_and_send_notifications every 60 s),
+so it takes over a minute to run.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="bench-push-")
+sys.path.insert(0, ROOT)
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(WORKDIR, 'bench.sqlite')}"
+os.environ["PUSH_RECEIPT_INTERVAL_MINUTES"] = "60"
+
+from exponent_server_sdk import PushTicket  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from data.config import engine, new_session, seed_microgreens_library, UserOrm, LotOrm  # noqa: E402
+from data.migrations import run_migrations  # noqa: E402
+from models.notification import CreateNotification  # noqa: E402
+from service import notification, push_scheduler  # noqa: E402
+
+MODE = sys.argv[1] if len(sys.argv) > 1 else "timer"
+IDLE_SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+POLL_SECONDS = 60
+# notifications due this far after they are created
+OFFSETS = (1.0, 1.5, 2.2, 3.0)
+
+sent: dict[str, datetime] = {}
+
+
+class FakePushClient:
+    def publish_multiple(self, messages):
+        for message in messages:
+            sent[message.body] = datetime.utcnow()
+        return [PushTicket(message, PushTicket.SUCCESS_STATUS, "", None, None) for message in messages]
+
+
+async def poll_loop():
+    while True:
+        await asyncio.sleep(POLL_SECONDS)
+        await push_scheduler.check_and_send_notifications()
+
+
+async def main():
+    await run_migrations()
+    await seed_microgreens_library()
+    async with new_session() as session:
+        user = UserOrm(email="bench@example.com", hashed_password="x", expo_push_token="ExponentPushToken[bench]")
+        session.add(user)
+        await session.flush()
+        lot = LotOrm(user_id=user.id, microgreen_id=1, sowing_date=datetime(2026, 1, 1), substrate_type="soil",
+                     expected_harvest_date=datetime(2026, 1, 9))
+        session.add(lot)
+        await session.commit()
+        user_id, lot_id = user.id, lot.id
+    push_scheduler.push_client = FakePushClient()
+
+    if MODE == "poll":
+        task = asyncio.create_task(poll_loop())
+    else:
+        push_scheduler.start_scheduler()
+    await asyncio.sleep(0.5)
+
+    queries = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(1))
+    await asyncio.sleep(IDLE_SECONDS)
+    idle_queries = len(queries)
+
+    base = datetime.utcnow()
+    due = {}
+    async with new_session() as session:
+        for number, offset in enumerate(OFFSETS):
+            message = f"n{number}"
+            due[message] = base + timedelta(seconds=offset)
+            await notification.create_notification(
+                session, CreateNotification(message=message, scheduled_at=due[message]), lot_id, user_id)
+
+    deadline = time.monotonic() + max(OFFSETS) + (POLL_SECONDS + 5 if MODE == "poll" else 2)
+    while len(sent) < len(due) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    if MODE == "poll":
+        task.cancel()
+    else:
+        push_scheduler.push_client = None
+        await push_scheduler.stop_scheduler()
+    lateness = [(sent[message] - at).total_seconds() * 1000 for message, at in due.items() if message in sent]
+    print(f"{MODE:6s} idle queries over {IDLE_SECONDS:g}s: {idle_queries}")
+    print(f"{MODE:6s} delivered {len(lateness)}/{len(due)}, lateness ms: "
+          f"{', '.join(f'{value:.0f}' for value in lateness)}"
+          + (f" (median {statistics.median(lateness):.0f})" if lateness else ""))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+"""Cold worker start: importing src/main.py and running its lifespan, each run in a fresh interpreter.
+
+    python benchmarks/startup.py [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+HEAVY_MODULES = ("g4f", "exponent_server_sdk")
+
+CHILD = f"""
+import json, sys, time
+sys.path[:0] = [{ROOT!r}, {os.path.join(ROOT, "src")!r}]
+started = time.perf_counter()
+import main
+imported = time.perf_counter() - started
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+from fastapi.testclient import TestClient
+started = time.perf_counter()
+with TestClient(main.app):
+    lifespan = time.perf_counter() - started
+print(json.dumps({{"import": imported * 1000, "lifespan": lifespan * 1000, "loaded": loaded}}))
+"""
+
+
+def run_once(workdir: str) -> dict:
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.sqlite')}",
+        "STATIC_DIR": os.path.join(workdir, "static"),
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark-secret-key-" + "x" * 24),
+    }
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", CHILD], cwd=os.path.join(ROOT, "src"), env=env,
+                         capture_output=True, text=True, check=True).stdout
+    # the app logs with print, so the result is the last line
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="bench-start-")
+    os.makedirs(os.path.join(workdir, "static"), exist_ok=True)
+    # the first run creates and migrates the database; the rest start against an existing file
+    first = run_once(workdir)
+    runs = [run_once(workdir) for _ in range(RUNS)]
+    print(f"first boot   import {first['import']:.0f} ms  lifespan {first['lifespan']:.0f} ms")
+    print(f"warm boots   import {statistics.median(run['import'] for run in runs):.0f} ms  "
+          f"lifespan {statistics.median(run['lifespan'] for run in runs):.0f} ms  (median of {RUNS})")
+    print(f"SDKs loaded at startup: {', '.join(runs[-1]['loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import math
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from data.config import EntryOrm, LotOrm, GrowthBaselineOrm
+
+BUCKET_WIDTHS = {
+    "height": float(os.getenv("BASELINE_HEIGHT_BUCKET", "0.5")),
+    "moisture": float(os.getenv("BASELINE_MOISTURE_BUCKET", "2")),
+}
+
+
+def day_since_sowing(sowing_date: datetime, entry_date: datetime) -> int:
+    return (entry_date - sowing_date).days
+
+
+def bucket_deltas(rows: Iterable, sign: int = 1) -> Dict[Tuple[int, int, str, int], list]:
+    # rows are (microgreen_id, sowing_date, entry_date, height, moisture) -> {(microgreen, day, metric, bucket): [count, sum]}
+    deltas = {}
+    for microgreen_id, sowing_date, entry_date, height, moisture in rows:
+        day = day_since_sowing(sowing_date, entry_date)
+        if day < 0:
+            continue
+        for metric, value in (("height", height), ("moisture", moisture)):
+            key = (microgreen_id, day, metric, math.floor(value / BUCKET_WIDTHS[metric]))
+            delta = deltas.setdefault(key, [0, 0.0])
+            delta[0] += sign
+            delta[1] += sign * value
+    return deltas
+
+
+def entry_rows_query(*conditions):
+    return (
+        select(LotOrm.microgreen_id, LotOrm.sowing_date, EntryOrm.entry_date, EntryOrm.height, EntryOrm.moisture)
+        .join(LotOrm, EntryOrm.lot_id == LotOrm.id)
+        .where(*conditions)
+    )
+
+
+def upsert_statement(dialect_name: str, deltas: dict):
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    statement = insert(GrowthBaselineOrm).values([
+        {"microgreen_id": microgreen_id, "day": day, "metric": metric, "bucket": bucket,
+         "count": count, "value_sum": value_sum}
+        for (microgreen_id, day, metric, bucket), (count, value_sum) in deltas.items()
+    ])
+    # one atomic statement, so concurrent writers on other workers add up instead of overwriting
+    return statement.on_conflict_do_update(
+        index_elements=["microgreen_id", "day", "metric", "bucket"],
+        set_={
+            "count": GrowthBaselineOrm.count + statement.excluded.count,
+            "value_sum": GrowthBaselineOrm.value_sum + statement.excluded.value_sum,
+        },
+    )
+
+
+def backfill(conn):
+    # sync; used by the migration that creates the table
+    deltas = bucket_deltas(conn.execute(entry_rows_query()).all())
+    if deltas:
+        conn.execute(upsert_statement(conn.dialect.name, deltas))
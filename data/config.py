@@ -1,16 +1,95 @@
 import os
-from sqlalchemy import ForeignKey, UniqueConstraint, DateTime, func, String
+from dotenv import load_dotenv
+from sqlalchemy import ForeignKey, UniqueConstraint, DateTime, func, String, event, Index, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import Mapped, mapped_column, declarative_base, relationship
 from sqlalchemy import select
 
+load_dotenv()
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATABASE_URL = f"sqlite+aiosqlite:///{os.path.join(BASE_DIR, 'db', 'microgreens_db.sqlite')}"
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"sqlite+aiosqlite:///{os.path.join(BASE_DIR, 'db', 'microgreens_db.sqlite')}"
+)
 
-engine = create_async_engine(DATABASE_URL)
+STATIC_DIR = os.getenv("STATIC_DIR", os.path.join(BASE_DIR, "static"))
+PHOTO_DIR = os.path.join(STATIC_DIR, "images", "entries")
+PHOTO_URL_PREFIX = "/static/images/entries/"
+MAX_PHOTO_SIZE = int(os.getenv("MAX_PHOTO_SIZE", str(10 * 1024 * 1024)))
+# multipart framing and the form fields that travel with the photo
+MAX_REQUEST_BODY = int(os.getenv("MAX_REQUEST_BODY", str(MAX_PHOTO_SIZE + 64 * 1024)))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-16000"))
+
+
+def photo_file_path(photo_url: str) -> str:
+    # photo_url is the public /static/... path; older rows hold ../static/... relative to src/
+    return os.path.join(STATIC_DIR, photo_url.split("static/", 1)[-1])
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def engine_options(url: str) -> dict:
+    options = {
+        "echo": DB_ECHO,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+    if is_sqlite(url) and make_url(url).database in (None, "", ":memory:"):
+        # in-memory databases live on a single connection, so there is no pool to size
+        return {"echo": DB_ECHO}
+    if is_sqlite(url):
+        # the driver-level timeout is in seconds; busy_timeout below covers the same wait in SQLite itself
+        options["connect_args"] = {"timeout": SQLITE_BUSY_TIMEOUT / 1000}
+    else:
+        # a local SQLite file can't drop the connection; a server can, so check it before handing it out
+        options["pool_pre_ping"] = True
+        options["pool_recycle"] = DB_POOL_RECYCLE
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def build_engine(url: str = DATABASE_URL):
+    async_engine = create_async_engine(url, **engine_options(url))
+    if is_sqlite(url):
+        event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+    return async_engine
+
+
+engine = build_engine()
 new_session = async_sessionmaker(engine, expire_on_commit=False)
 
+
+async def get_session():
+    # one session (and one pooled connection) per request, shared by every service call
+    async with new_session() as session:
+        yield session
+
+
 Base = declarative_base()
 
 
@@ -53,11 +132,15 @@ class UserOrm(Base):
 
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now())
 
-    lots: Mapped[list['LotOrm'] | None] = relationship('LotOrm', back_populates='user', cascade="all, delete")
+    lots: Mapped[list['LotOrm'] | None] = relationship('LotOrm', back_populates='user', cascade="all, delete",
+                                                       passive_deletes=True)
 
 
 class LotOrm(Base):
     __tablename__ = 'lots'
+    __table_args__ = (
+        Index('ix_lots_user_id', 'user_id'),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     microgreen_id: Mapped[int] = mapped_column(ForeignKey('microgreens_library.id', ondelete='CASCADE'), nullable=False)
@@ -68,18 +151,27 @@ class LotOrm(Base):
 
     user: Mapped['UserOrm'] = relationship('UserOrm', back_populates='lots')
     microgreen: Mapped['MicrogreenOrm'] = relationship('MicrogreenOrm', back_populates='lots')
-    entries: Mapped[list['EntryOrm'] | None] = relationship('EntryOrm', back_populates='lot', cascade="all, delete")
+    # rows are removed by ON DELETE CASCADE (foreign_keys=ON), not loaded and deleted one by one
+    entries: Mapped[list['EntryOrm'] | None] = relationship('EntryOrm', back_populates='lot', cascade="all, delete",
+                                                            passive_deletes=True)
     notifications: Mapped[list['NotificationOrm'] | None] = relationship('NotificationOrm', back_populates='lot',
-                                                                         cascade="all, delete")
+                                                                         cascade="all, delete",
+                                                                         passive_deletes=True)
 
 
 class EntryOrm(Base):
     __tablename__ = 'entries'
+    __table_args__ = (
+        Index('ix_entries_lot_id_entry_date', 'lot_id', 'entry_date'),
+        Index('ix_entries_photo_url', 'photo_url'),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     lot_id: Mapped[int] = mapped_column(ForeignKey('lots.id', ondelete='CASCADE'), nullable=False)
     entry_date: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
     description: Mapped[str]
     photo_url: Mapped[str]
+    thumbnail_url: Mapped[str] = mapped_column(String, nullable=True)
+    medium_url: Mapped[str] = mapped_column(String, nullable=True)
     height: Mapped[float]
     moisture: Mapped[float]
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now())
@@ -89,21 +181,92 @@ class EntryOrm(Base):
 
 class NotificationOrm(Base):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        Index('ix_notifications_lot_id', 'lot_id'),
+        Index('ix_notifications_is_delivered_scheduled_at', 'is_delivered', 'scheduled_at'),
+        # the scheduler only ever scans undelivered rows, so keep that index small
+        Index('ix_notifications_undelivered_scheduled_at', 'scheduled_at',
+              sqlite_where=text('is_delivered = 0'), postgresql_where=text('is_delivered = false')),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     lot_id: Mapped[int] = mapped_column(ForeignKey('lots.id', ondelete='CASCADE'), nullable=False)
     message: Mapped[str]
     scheduled_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
     is_delivered: Mapped[bool] = mapped_column(default=False)
     created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now())
+    # set while a worker is sending the row; an expired lease can be claimed again
+    lease_owner: Mapped[str] = mapped_column(String, nullable=True)
+    lease_expires_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
+    # claims so far, and the Expo error that ended delivery for good; either stops the row being claimed again
+    send_attempts: Mapped[int] = mapped_column(default=0, server_default=text('0'), nullable=False)
+    delivery_error: Mapped[str] = mapped_column(String, nullable=True)
 
     lot: Mapped['LotOrm'] = relationship('LotOrm', back_populates='notifications')
 
 
+class PushTicketOrm(Base):
+    # Expo ticket ids waiting for their delivery receipt (available after ~15 min, kept by Expo for 24 h)
+    __tablename__ = 'push_tickets'
+    __table_args__ = (
+        Index('ix_push_tickets_created_at', 'created_at'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    ticket_id: Mapped[str] = mapped_column(String, unique=True, nullable=False)
+    expo_push_token: Mapped[str] = mapped_column(String, nullable=False)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+
+
+class AnalysisJobOrm(Base):
+    __tablename__ = 'analysis_jobs'
+    __table_args__ = (
+        Index('ix_analysis_jobs_status_run_after', 'status', 'run_after'),
+        Index('ix_analysis_jobs_lot_id', 'lot_id'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    lot_id: Mapped[int] = mapped_column(ForeignKey('lots.id', ondelete='CASCADE'), nullable=False)
+    # pending -> running -> done | failed
+    status: Mapped[str] = mapped_column(String, default="pending", nullable=False)
+    run_after: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    attempts: Mapped[int] = mapped_column(default=0)
+    error: Mapped[str] = mapped_column(String, nullable=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now())
+    updated_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+
+
+class AnalysisResultOrm(Base):
+    __tablename__ = 'analysis_results'
+    __table_args__ = (
+        UniqueConstraint('lot_id', 'fingerprint', name='unique_analysis_lot_fingerprint'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    lot_id: Mapped[int] = mapped_column(ForeignKey('lots.id', ondelete='CASCADE'), nullable=False)
+    # hash of everything the prompt is built from: lot dates, entry rows and the latest photo
+    fingerprint: Mapped[str] = mapped_column(String, nullable=False)
+    result: Mapped[str] = mapped_column(String, nullable=False)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now())
+
+
+class GrowthBaselineOrm(Base):
+    # histogram of every entry's height / moisture per species and day since sowing, kept up to date by service.entry
+    __tablename__ = 'growth_baselines'
+    __table_args__ = (
+        UniqueConstraint('microgreen_id', 'day', 'metric', 'bucket', name='unique_growth_baseline_bucket'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    microgreen_id: Mapped[int] = mapped_column(ForeignKey('microgreens_library.id', ondelete='CASCADE'),
+                                               nullable=False)
+    day: Mapped[int] = mapped_column(nullable=False)
+    metric: Mapped[str] = mapped_column(String, nullable=False)
+    # values in [bucket * width, (bucket + 1) * width)
+    bucket: Mapped[int] = mapped_column(nullable=False)
+    count: Mapped[int] = mapped_column(default=0, nullable=False)
+    value_sum: Mapped[float] = mapped_column(default=0.0, nullable=False)
+
+
 async def seed_microgreens_library():
     async with new_session() as session:
-        result = await session.execute(select(MicrogreenOrm))
-        microgreens = result.scalars().all()
-        if not microgreens:
+        result = await session.execute(select(MicrogreenOrm.id).limit(1))
+        if result.scalar() is None:
             default_microgreens = [
                 MicrogreenOrm(name="Basil", days_to_grow=15, temperature="22", light="Bright",
                               avatar="https://australianwheatgrass.com.au/cdn/shop/products/green-basil-microgreen-seeds_600x600_crop_center.jpg?v=1653413766"),
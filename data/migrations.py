@@ -0,0 +1,92 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, insert, select, inspect
+from sqlalchemy.schema import CreateColumn
+
+from data.config import engine, Base, EntryOrm, LotOrm, NotificationOrm, AnalysisJobOrm, AnalysisResultOrm, \
+    GrowthBaselineOrm, PushTicketOrm
+from data import baselines
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', migration_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def create_indexes(*indexes):
+    def upgrade(conn):
+        for index in indexes:
+            index.create(bind=conn, checkfirst=True)
+    return upgrade
+
+
+def create_tables(*orms):
+    def upgrade(conn):
+        for orm in orms:
+            orm.__table__.create(bind=conn, checkfirst=True)
+    return upgrade
+
+
+def create_tables_with(orm, fill):
+    def upgrade(conn):
+        orm.__table__.create(bind=conn, checkfirst=True)
+        fill(conn)
+    return upgrade
+
+
+def add_columns(orm, *names):
+    def upgrade(conn):
+        existing = {column["name"] for column in inspect(conn).get_columns(orm.__tablename__)}
+        for name in names:
+            if name in existing:
+                continue
+            column_ddl = CreateColumn(orm.__table__.c[name]).compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {orm.__tablename__} ADD COLUMN {column_ddl}")
+    return upgrade
+
+
+def index(orm, name: str):
+    return next(i for i in orm.__table__.indexes if i.name == name)
+
+
+# (version, name, upgrade(sync_connection)); append only, never renumber
+MIGRATIONS = [
+    (1, "secondary indexes", create_indexes(
+        index(LotOrm, 'ix_lots_user_id'),
+        index(EntryOrm, 'ix_entries_lot_id_entry_date'),
+        index(NotificationOrm, 'ix_notifications_lot_id'),
+        index(NotificationOrm, 'ix_notifications_is_delivered_scheduled_at'),
+        index(NotificationOrm, 'ix_notifications_undelivered_scheduled_at'),
+    )),
+    (2, "entry photo variants", add_columns(EntryOrm, 'thumbnail_url', 'medium_url')),
+    (3, "entry photo reference index", create_indexes(index(EntryOrm, 'ix_entries_photo_url'))),
+    (4, "analysis job queue", create_tables(AnalysisJobOrm)),
+    (5, "persistent analysis results", create_tables(AnalysisResultOrm)),
+    (6, "species growth baselines", create_tables_with(GrowthBaselineOrm, baselines.backfill)),
+    (7, "notification delivery leases", add_columns(NotificationOrm, 'lease_owner', 'lease_expires_at')),
+    (8, "push receipt tickets", create_tables(PushTicketOrm)),
+    (9, "notification send attempts", add_columns(NotificationOrm, 'send_attempts', 'delivery_error')),
+]
+
+
+async def run_migrations():
+    async with engine.begin() as conn:
+        await conn.run_sync(migration_metadata.create_all)
+        result = await conn.execute(select(schema_migrations.c.version))
+        applied = set(result.scalars().all())
+        if not applied:
+            # fresh database, or one created before migrations were tracked
+            await conn.run_sync(Base.metadata.create_all)
+
+        for version, name, upgrade in MIGRATIONS:
+            if version in applied:
+                continue
+            await conn.run_sync(upgrade)
+            await conn.execute(insert(schema_migrations).values(
+                version=version, name=name, applied_at=datetime.utcnow()
+            ))
+            print(f"Applied migration {version}: {name}")
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+
+class AnalysisJobRead(BaseModel):
+    id: int
+    lot_id: int
+    status: str
+    run_after: datetime
+    attempts: int
+    error: str | None = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class AnalysisResponse(BaseModel):
+    result: str | None = None
+    # result was produced from older entries (or is too old) and a fresh run is queued
+    stale: bool = False
+    job: AnalysisJobRead | None = None
@@ -0,0 +1,22 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class MetricBaseline(BaseModel):
+    mean: float
+    p10: float
+    p50: float
+    p90: float
+
+
+class DayBaseline(BaseModel):
+    day: int
+    count: int
+    height: MetricBaseline
+    moisture: MetricBaseline
+
+
+class MicrogreenBaseline(BaseModel):
+    microgreen_id: int
+    days: List[DayBaseline] = []
@@ -12,6 +12,8 @@ class EntryRead(EntryCreate):
     lot_id: int
     created_at: datetime
     photo_url: str
+    thumbnail_url: str | None = None
+    medium_url: str | None = None
 
     class Config:
         from_attributes = True
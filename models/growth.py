@@ -0,0 +1,65 @@
+from datetime import datetime
+from typing import List
+
+from pydantic import BaseModel
+
+from models.baseline import MetricBaseline
+
+
+class GrowthAnomaly(BaseModel):
+    entry_id: int
+    entry_date: datetime
+    metric: str
+    kind: str
+    value: float
+    expected: float | None = None
+
+
+class GrowthReport(BaseModel):
+    lot_id: int
+    samples: int
+    first_entry_date: datetime | None = None
+    last_entry_date: datetime | None = None
+    days_since_sowing: float
+
+    height_current: float | None = None
+    # height units per day from a least-squares line; acceleration from a quadratic fit
+    growth_rate: float | None = None
+    growth_fit_r2: float | None = None
+    growth_acceleration: float | None = None
+
+    moisture_mean: float | None = None
+    moisture_variance: float | None = None
+    moisture_std: float | None = None
+    moisture_trend: float | None = None
+
+    anomalies: List[GrowthAnomaly] = []
+
+    expected_harvest_date: datetime
+    species_harvest_date: datetime | None = None
+    projected_harvest_date: datetime
+    projected_delay_days: float
+    projected_height_at_harvest: float | None = None
+
+    # the same species on the same day since sowing, from service.baselines
+    species_day: int | None = None
+    species_samples: int | None = None
+    species_height: MetricBaseline | None = None
+    species_moisture: MetricBaseline | None = None
+    species_height_percentile: float | None = None
+    species_moisture_percentile: float | None = None
+
+
+class SeriesPoint(BaseModel):
+    entry_date: datetime
+    value: float
+    # range of the raw values this point stands for
+    min: float
+    max: float
+
+
+class GrowthSeriesResponse(BaseModel):
+    lot_id: int
+    samples: int
+    height: List[SeriesPoint] = []
+    moisture: List[SeriesPoint] = []
@@ -17,4 +17,5 @@ class Password(BaseModel):
 
 
 class PushTokenUpdate(BaseModel):
-    expo_push_token: str
+    # the same check exponent_server_sdk runs before sending
+    expo_push_token: str = Field(pattern=r"^ExponentPushToken")
@@ -1,27 +1,40 @@
+import hashlib
+import json
+import os
+from typing import List, NamedTuple
+from datetime import datetime, timedelta
+
 from fastapi import HTTPException, status
-from sqlalchemy import select
-from data.config import new_session
-from typing import List
-from service import entry, lot
-import g4f
-from g4f.client import AsyncClient
-from g4f.Provider.OIVSCode import OIVSCode
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from data.config import new_session, photo_file_path, AnalysisResultOrm
+from service import entry, lot, analysis_queue, growth
 from cachetools import LRUCache
 from models import entry as entry_mod
 from models import lot as lot_mod
-from datetime import datetime
+from tools.single_flight import SingleFlight
+from tools import ai_client
 
-cache = LRUCache(maxsize=100)
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1000"))
+# the prompt counts days left to harvest, so a result is redone after this long even if nothing else changed
+ANALYSIS_MAX_AGE = int(os.getenv("ANALYSIS_MAX_AGE", str(24 * 3600)))
+ANALYSIS_HISTORY = int(os.getenv("ANALYSIS_HISTORY", "5"))
 
 
-async def request_to_AI(path: str, entries: List[entry_mod.EntryRead], lot_model: lot_mod.LotDetailResponse):
-    client = AsyncClient(
-        provider=OIVSCode
-    )
+class StoredAnalysis(NamedTuple):
+    result: str
+    created_at: datetime
+
+
+# front tier over analysis_results; a (lot, fingerprint) row never changes, so other workers can't make it wrong
+cache = LRUCache(maxsize=ANALYSIS_CACHE_SIZE)
+# overlapping jobs or callers for the same lot and inputs share one provider call
+flights = SingleFlight()
+
 
-    image = open(path, "rb")
+async def request_to_AI(path: str, summary: str, lot_model: lot_mod.LotDetailResponse):
     prompt = f"""
-        Вот данные о растении (история изменений во времени):\n\n{entries}
+        Вот сводка по истории измерений растения (рассчитана по всем записям):\n\n{summary}
 
         Фото последней записи (используйте для визуального анализа):\n
 
@@ -45,45 +58,124 @@ async def request_to_AI(path: str, entries: List[entry_mod.EntryRead], lot_model
         6️⃣ **Прогноз на сбор урожая**: ТЕКСТ (Успеют ли ростки вырасти до ожидаемой даты сбора? Сколько составит рисе задержки урожая (в погрешности пару дней)
         """
 
-    response = await client.chat.completions.create(
-        model=g4f.models.default,
-        messages=[
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
-        image=image
-    )
+    return await ai_client.complete(prompt, path)
 
-    return response.choices[0].message.content
 
+def analysis_fingerprint(lot_detail, entries: List[entry_mod.EntryRead]) -> str:
+    # photo urls are content hashes, so a replaced photo changes the fingerprint too
+    payload = {
+        "sowing_date": lot_detail.sowing_date.isoformat(),
+        "expected_harvest_date": lot_detail.expected_harvest_date.isoformat(),
+        "entries": [item.model_dump(mode="json") for item in entries],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
 
-async def analyze_plant_data(lot_id: int):
-    entries = await entry.get_entries(lot_id)
-    if not entries:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not enough data!")
 
-    cache.pop(lot_id, None)
+def is_fresh(stored: StoredAnalysis) -> bool:
+    return datetime.utcnow() - stored.created_at < timedelta(seconds=ANALYSIS_MAX_AGE)
 
-    lot_detail = await lot.get_lot_detail(lot_id)
-    latest_image_path = entries[-1].photo_url
-    response = await request_to_AI(latest_image_path, entries, lot_detail)
 
-    cache[lot_id] = response
+async def find_result(session: AsyncSession, lot_id: int, fingerprint: str) -> StoredAnalysis | None:
+    stored = cache.get((lot_id, fingerprint))
+    if stored is not None:
+        return stored
+    result = await session.execute(
+        select(AnalysisResultOrm.result, AnalysisResultOrm.created_at)
+        .where(AnalysisResultOrm.lot_id == lot_id, AnalysisResultOrm.fingerprint == fingerprint)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    stored = cache[(lot_id, fingerprint)] = StoredAnalysis(row.result, row.created_at)
+    return stored
+
+
+async def latest_result(session: AsyncSession, lot_id: int) -> str | None:
+    result = await session.execute(
+        select(AnalysisResultOrm.result)
+        .where(AnalysisResultOrm.lot_id == lot_id)
+        .order_by(AnalysisResultOrm.created_at.desc())
+        .limit(1)
+    )
+    return result.scalar()
+
+
+async def store_result(session: AsyncSession, lot_id: int, fingerprint: str, response: str):
+    stored = StoredAnalysis(response, datetime.utcnow())
+    await session.execute(
+        delete(AnalysisResultOrm)
+        .where(AnalysisResultOrm.lot_id == lot_id, AnalysisResultOrm.fingerprint == fingerprint)
+    )
+    session.add(AnalysisResultOrm(lot_id=lot_id, fingerprint=fingerprint, result=response,
+                                  created_at=stored.created_at))
+    await session.flush()
+    # keep a few recent results per lot, so going back to earlier inputs (a deleted entry) is still a hit
+    keep = (
+        select(AnalysisResultOrm.id)
+        .where(AnalysisResultOrm.lot_id == lot_id)
+        .order_by(AnalysisResultOrm.created_at.desc())
+        .limit(ANALYSIS_HISTORY)
+    )
+    await session.execute(
+        delete(AnalysisResultOrm)
+        .where(AnalysisResultOrm.lot_id == lot_id, AnalysisResultOrm.id.not_in(keep))
+    )
+    await session.commit()
+    cache[(lot_id, fingerprint)] = stored
 
 
-async def get_cached_analysis(lot_id: int, user_id: int) -> dict | None:
-    lot_model = await lot.get_lot_detail(lot_id)
-    if not lot_model:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lot not found")
-    if lot_model.user_id != user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to add an entry to this lot"
-        )
-    cached_result = cache.get(lot_id)
-    if cached_result:
-        return {"result": cached_result}
+async def analyze_plant_data(session: AsyncSession, lot_id: int) -> str:
+    entries = await entry.get_entries(session, lot_id)
+    if not entries:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not enough data!")
 
-    else:
-        await analyze_plant_data(lot_id)
\ No newline at end of file
+    lot_detail = await lot.get_lot_detail(session, lot_id)
+    fingerprint = analysis_fingerprint(lot_detail, entries)
+    stored = await find_result(session, lot_id, fingerprint)
+    if stored is not None and is_fresh(stored):
+        return stored.result
+
+    summary = await prompt_summary(session, lot_detail, entries)
+    return await flights.do((lot_id, fingerprint), lambda: run_analysis(lot_id, fingerprint, entries, lot_detail, summary))
+
+
+async def prompt_summary(session: AsyncSession, lot_detail, entries: List[entry_mod.EntryRead]) -> str:
+    # a few lines of fitted numbers instead of the repr of every entry keeps the prompt small at any history length
+    series = growth.build_series([(item.id, item.entry_date, item.height, item.moisture) for item in entries],
+                                 lot_detail.sowing_date)
+    report = await growth.report_for_series(session, lot_detail, series)
+    return f"{growth.growth_summary(report, series)}\nПоследняя заметка: {entries[-1].description}"
+
+
+async def run_analysis(lot_id: int, fingerprint: str, entries: List[entry_mod.EntryRead], lot_detail,
+                       summary: str) -> str:
+    # the medium variant is plenty for a visual check and a fraction of the camera original
+    latest_image_path = photo_file_path(entries[-1].medium_url or entries[-1].photo_url)
+    response = await request_to_AI(latest_image_path, summary, lot_detail)
+
+    # own session: the flight can outlive the caller that started it
+    async with new_session() as session:
+        await store_result(session, lot_id, fingerprint, response)
+    return response
+
+
+async def get_cached_analysis(session: AsyncSession, lot_id: int, user_id: int) -> dict:
+    await lot.check_lot_owner(session, lot_id, user_id, "You are not allowed to add an entry to this lot")
+    entries = await entry.get_entries(session, lot_id)
+    result, stale = None, False
+    if entries:
+        lot_detail = await lot.get_lot_detail(session, lot_id)
+        stored = await find_result(session, lot_id, analysis_fingerprint(lot_detail, entries))
+        if stored is not None:
+            result, stale = stored.result, not is_fresh(stored)
+        else:
+            # inputs changed since the last run: show that one until the new one is ready
+            result, stale = await latest_result(session, lot_id), True
+
+    job = await analysis_queue.get_latest_job(session, lot_id)
+    if stale and analysis_queue.needs_refresh(job):
+        await analysis_queue.enqueue(session, lot_id, delay=0)
+        await session.commit()
+        analysis_queue.wake()
+        job = await analysis_queue.get_latest_job(session, lot_id)
+    return {"result": result, "stale": stale, "job": job}
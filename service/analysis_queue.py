@@ -0,0 +1,173 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from data.config import new_session, AnalysisJobOrm
+from models.analysis import AnalysisJobRead
+from service import analysis
+
+ANALYSIS_DEBOUNCE_SECONDS = int(os.getenv("ANALYSIS_DEBOUNCE_SECONDS", "30"))
+# a lot that keeps getting entries is still analysed at least this often
+ANALYSIS_MAX_DELAY_SECONDS = int(os.getenv("ANALYSIS_MAX_DELAY_SECONDS", "300"))
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))
+ANALYSIS_RETRY_SECONDS = int(os.getenv("ANALYSIS_RETRY_SECONDS", "60"))
+# a lot whose last job gave up is tried again on the next read after this long
+ANALYSIS_FAILED_RETRY_SECONDS = int(os.getenv("ANALYSIS_FAILED_RETRY_SECONDS", "900"))
+# running jobs older than this belong to a crashed process and are picked up again
+ANALYSIS_JOB_TIMEOUT_SECONDS = int(os.getenv("ANALYSIS_JOB_TIMEOUT_SECONDS", "600"))
+# safety net for jobs enqueued by other worker processes
+IDLE_POLL_SECONDS = 60
+
+wakeup = asyncio.Event()
+worker_task: asyncio.Task | None = None
+running_tasks: set = set()
+
+
+async def enqueue(session: AsyncSession, lot_id: int, delay: int = ANALYSIS_DEBOUNCE_SECONDS) -> AnalysisJobOrm:
+    # the caller commits and then calls wake()
+    now = datetime.utcnow()
+    result = await session.execute(
+        select(AnalysisJobOrm).where(AnalysisJobOrm.lot_id == lot_id, AnalysisJobOrm.status == "pending")
+    )
+    job = result.scalars().first()
+    if job:
+        # trailing debounce: a burst of entries collapses into one job
+        job.run_after = min(now + timedelta(seconds=delay), job.created_at + timedelta(seconds=ANALYSIS_MAX_DELAY_SECONDS))
+        job.updated_at = now
+    else:
+        job = AnalysisJobOrm(lot_id=lot_id, status="pending", run_after=now + timedelta(seconds=delay),
+                             attempts=0, created_at=now, updated_at=now)
+        session.add(job)
+    return job
+
+
+def wake():
+    wakeup.set()
+
+
+def needs_refresh(job: AnalysisJobRead | None) -> bool:
+    # for a stale result: nothing is queued or running for the lot, and a failure has had time to clear up
+    if job is None or job.status == "done":
+        return True
+    return job.status == "failed" and job.updated_at <= datetime.utcnow() - timedelta(seconds=ANALYSIS_FAILED_RETRY_SECONDS)
+
+
+async def get_latest_job(session: AsyncSession, lot_id: int) -> AnalysisJobRead | None:
+    result = await session.execute(
+        select(AnalysisJobOrm).where(AnalysisJobOrm.lot_id == lot_id).order_by(AnalysisJobOrm.id.desc()).limit(1)
+    )
+    job = result.scalars().first()
+    return AnalysisJobRead.from_orm(job) if job else None
+
+
+async def recover_stale_jobs():
+    async with new_session() as session:
+        await session.execute(
+            update(AnalysisJobOrm)
+            .where(AnalysisJobOrm.status == "running",
+                   AnalysisJobOrm.updated_at < datetime.utcnow() - timedelta(seconds=ANALYSIS_JOB_TIMEOUT_SECONDS))
+            .values(status="pending", run_after=datetime.utcnow(), updated_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+async def claim_next_job():
+    async with new_session() as session:
+        result = await session.execute(
+            select(AnalysisJobOrm.id, AnalysisJobOrm.lot_id, AnalysisJobOrm.attempts)
+            .where(AnalysisJobOrm.status == "pending", AnalysisJobOrm.run_after <= datetime.utcnow())
+            .order_by(AnalysisJobOrm.run_after)
+            .limit(1)
+        )
+        job = result.first()
+        if job is None:
+            return None
+        # conditional update, so two processes never run the same job
+        claimed = await session.execute(
+            update(AnalysisJobOrm)
+            .where(AnalysisJobOrm.id == job.id, AnalysisJobOrm.status == "pending")
+            .values(status="running", attempts=AnalysisJobOrm.attempts + 1, updated_at=datetime.utcnow())
+        )
+        await session.commit()
+        return job if claimed.rowcount == 1 else None
+
+
+async def seconds_until_next_job() -> float:
+    async with new_session() as session:
+        result = await session.execute(
+            select(func.min(AnalysisJobOrm.run_after)).where(AnalysisJobOrm.status == "pending")
+        )
+        run_after = result.scalar()
+    if run_after is None:
+        return IDLE_POLL_SECONDS
+    return min(max((run_after - datetime.utcnow()).total_seconds(), 0), IDLE_POLL_SECONDS)
+
+
+async def run_job(job_id: int, lot_id: int, attempt: int):
+    values = {"status": "done", "error": None}
+    async with new_session() as session:
+        try:
+            await analysis.analyze_plant_data(session, lot_id)
+        except Exception as e:
+            # client errors such as "Not enough data!" will not fix themselves on retry
+            retryable = not (isinstance(e, HTTPException) and e.status_code < 500)
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"Analysis job {job_id} for lot {lot_id} failed: {error}")
+            if retryable and attempt < ANALYSIS_MAX_ATTEMPTS:
+                values = {"status": "pending", "error": error,
+                          "run_after": datetime.utcnow() + timedelta(seconds=ANALYSIS_RETRY_SECONDS * attempt)}
+            else:
+                values = {"status": "failed", "error": error}
+        await session.rollback()
+        await session.execute(
+            update(AnalysisJobOrm).where(AnalysisJobOrm.id == job_id).values(**values, updated_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+async def worker_loop():
+    slots = asyncio.Semaphore(ANALYSIS_WORKERS)
+    await recover_stale_jobs()
+    while True:
+        await slots.acquire()
+        try:
+            job = await claim_next_job()
+        except Exception as e:
+            slots.release()
+            print(f"Error claiming analysis job: {e}")
+            await asyncio.sleep(IDLE_POLL_SECONDS)
+            continue
+
+        if job is None:
+            slots.release()
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=await seconds_until_next_job())
+            except asyncio.TimeoutError:
+                await recover_stale_jobs()
+            continue
+
+        task = asyncio.create_task(run_job(job.id, job.lot_id, job.attempts + 1))
+        running_tasks.add(task)
+        task.add_done_callback(running_tasks.discard)
+        task.add_done_callback(lambda _: slots.release())
+
+
+def start_worker():
+    global worker_task
+    worker_task = asyncio.create_task(worker_loop())
+    print("Analysis worker started.")
+
+
+async def stop_worker():
+    if worker_task is not None:
+        worker_task.cancel()
+    for task in [worker_task, *running_tasks]:
+        if task is not None:
+            task.cancel()
+    await asyncio.gather(*[task for task in [worker_task, *running_tasks] if task], return_exceptions=True)
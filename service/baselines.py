@@ -0,0 +1,151 @@
+import math
+import os
+from typing import Dict, NamedTuple
+
+import numpy as np
+from cachetools import TTLCache
+from fastapi import HTTPException, status
+from sqlalchemy import select, delete, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from data.baselines import BUCKET_WIDTHS, day_since_sowing, bucket_deltas, entry_rows_query, upsert_statement
+from data.config import GrowthBaselineOrm
+from models.baseline import MetricBaseline, DayBaseline, MicrogreenBaseline
+from service import microgreen_library
+
+# the table is always current and this process drops a species' view once its own write commits;
+# the TTL bounds how long other workers' writes take to show up here
+BASELINE_CACHE_TTL = int(os.getenv("BASELINE_CACHE_TTL", "30"))
+
+cache = TTLCache(maxsize=64, ttl=BASELINE_CACHE_TTL)
+
+
+@event.listens_for(Session, "after_commit")
+def evict_committed(session):
+    for microgreen_id in session.info.pop("baseline_species", ()):
+        cache.pop(microgreen_id, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_rolled_back(session):
+    session.info.pop("baseline_species", None)
+
+
+class Histogram(NamedTuple):
+    buckets: np.ndarray
+    counts: np.ndarray
+    # mean of the values in each bucket (value_sum / count); readings are often whole numbers sitting on a
+    # bucket's lower edge, so the bucket's own mean stands in for its values rather than a spread across it
+    means: np.ndarray
+    total: float
+    width: float
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def quantile(self, q: float) -> float:
+        # the mean of the bucket the q-th value falls into, so the result is always a value the species has shown
+        cumulative = np.cumsum(self.counts)
+        i = min(int(np.searchsorted(cumulative, q * cumulative[-1])), len(cumulative) - 1)
+        return float(self.means[i])
+
+    def percentile_of(self, value: float) -> float:
+        # mid-rank: values in the same bucket count half, so a lot equal to all the others sits at the 50th
+        bucket = math.floor(value / self.width)
+        below = self.counts[self.buckets < bucket].sum()
+        same = self.counts[self.buckets == bucket].sum()
+        return float(100 * (below + 0.5 * same) / self.counts.sum())
+
+    def summary(self) -> MetricBaseline:
+        return MetricBaseline(
+            mean=round(self.total / self.count, 3),
+            p10=round(self.quantile(0.1), 3),
+            p50=round(self.quantile(0.5), 3),
+            p90=round(self.quantile(0.9), 3),
+        )
+
+
+async def apply_entries(session: AsyncSession, *conditions, sign: int):
+    # call inside the transaction that inserts (sign=1, after flush) or deletes (sign=-1, before) the entries
+    result = await session.execute(entry_rows_query(*conditions))
+    deltas = bucket_deltas(result.all(), sign)
+    if not deltas:
+        return
+    await session.execute(upsert_statement(session.bind.dialect.name, deltas))
+    species = {key[0] for key in deltas}
+    # evicted again on commit: a read in between would cache the table as it was before this transaction
+    session.sync_session.info.setdefault("baseline_species", set()).update(species)
+    for microgreen_id in species:
+        cache.pop(microgreen_id, None)
+    if sign < 0:
+        await session.execute(
+            delete(GrowthBaselineOrm).where(
+                GrowthBaselineOrm.microgreen_id.in_(species),
+                GrowthBaselineOrm.count <= 0,
+            )
+        )
+
+
+async def load_histograms(session: AsyncSession, microgreen_id: int) -> Dict[int, Dict[str, Histogram]]:
+    histograms = cache.get(microgreen_id)
+    if histograms is not None:
+        return histograms
+    result = await session.execute(
+        select(GrowthBaselineOrm.day, GrowthBaselineOrm.metric, GrowthBaselineOrm.bucket,
+               GrowthBaselineOrm.count, GrowthBaselineOrm.value_sum)
+        .where(GrowthBaselineOrm.microgreen_id == microgreen_id, GrowthBaselineOrm.count > 0)
+        .order_by(GrowthBaselineOrm.day, GrowthBaselineOrm.metric, GrowthBaselineOrm.bucket)
+    )
+    grouped = {}
+    for day, metric, bucket, count, value_sum in result.all():
+        grouped.setdefault(day, {}).setdefault(metric, []).append((bucket, count, value_sum))
+    histograms = {
+        day: {
+            metric: Histogram(
+                buckets=np.array([row[0] for row in rows], dtype=np.int64),
+                counts=np.array([row[1] for row in rows], dtype=np.float64),
+                means=np.array([row[2] / row[1] for row in rows], dtype=np.float64),
+                total=float(sum(row[2] for row in rows)),
+                width=BUCKET_WIDTHS[metric],
+            )
+            for metric, rows in metrics.items()
+        }
+        for day, metrics in grouped.items()
+    }
+    cache[microgreen_id] = histograms
+    return histograms
+
+
+async def get_baseline(session: AsyncSession, microgreen_id: int) -> MicrogreenBaseline:
+    if microgreen_id not in (await microgreen_library.get_catalog(session)).by_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Microgreen not found")
+    histograms = await load_histograms(session, microgreen_id)
+    return MicrogreenBaseline(
+        microgreen_id=microgreen_id,
+        days=[
+            DayBaseline(
+                day=day,
+                count=metrics["height"].count,
+                height=metrics["height"].summary(),
+                moisture=metrics["moisture"].summary(),
+            )
+            for day, metrics in histograms.items()
+        ],
+    )
+
+
+async def compare(session: AsyncSession, microgreen_id: int, day: int, height: float, moisture: float) -> dict:
+    # where one tray stands against every tray of its species on the same day since sowing
+    metrics = (await load_histograms(session, microgreen_id)).get(day)
+    if not metrics:
+        return {}
+    return {
+        "species_day": day,
+        "species_samples": metrics["height"].count,
+        "species_height": metrics["height"].summary(),
+        "species_moisture": metrics["moisture"].summary(),
+        "species_height_percentile": round(metrics["height"].percentile_of(height), 1),
+        "species_moisture_percentile": round(metrics["moisture"].percentile_of(moisture), 1),
+    }
@@ -1,48 +1,116 @@
+import asyncio
+import hashlib
 import os
-import shutil
 import uuid
 from fastapi import HTTPException, status, UploadFile
-from sqlalchemy import select
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from data.config import new_session, EntryOrm
+from data.config import EntryOrm, PHOTO_DIR, PHOTO_URL_PREFIX, MAX_PHOTO_SIZE
 from models.entry import EntryCreate, EntryRead
 from typing import List
 
-from service import lot, analysis
+from service import lot, analysis_queue, baselines
+from tools import photo_cleanup, image_variants
 
 
-async def save_photo(upload: UploadFile, upload_dir: str = "../static/images/entries/") -> str:
-    os.makedirs(upload_dir, exist_ok=True)
-    file_extension = os.path.splitext(upload.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(upload_dir, unique_filename)
+PHOTO_CHUNK_SIZE = 256 * 1024
+PHOTO_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+    "image/heif": ".heif",
+}
 
-    # abs_path = os.path.abspath(file_path)
-    # print(f"Saving file to: {abs_path}")
+
+def photo_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Photo is larger than {MAX_PHOTO_SIZE // (1024 * 1024)} MB"
+    )
+
+
+async def save_photo(upload: UploadFile, upload_dir: str = PHOTO_DIR) -> str:
+    file_extension = PHOTO_EXTENSIONS.get(upload.content_type)
+    if file_extension is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Photo must be a JPEG, PNG, WebP or HEIC image"
+        )
+    if upload.size is not None and upload.size > MAX_PHOTO_SIZE:
+        raise photo_too_large()
+
+    # written under a temp name and renamed, so a half-written photo is never visible
+    temp_path = os.path.join(upload_dir, f".{uuid.uuid4()}.part")
+    digest = hashlib.sha256()
 
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(upload.file, buffer)
+        await asyncio.to_thread(os.makedirs, upload_dir, exist_ok=True)
+        buffer = await asyncio.to_thread(open, temp_path, "wb")
+        try:
+            size = 0
+            while chunk := await upload.read(PHOTO_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_PHOTO_SIZE:
+                    raise photo_too_large()
+                await asyncio.to_thread(write_chunk, buffer, digest, chunk)
+        finally:
+            await asyncio.to_thread(buffer.close)
+        relative_path = content_addressed_path(digest.hexdigest(), file_extension)
+        await asyncio.to_thread(store_photo, temp_path, os.path.join(upload_dir, relative_path))
+    except HTTPException:
+        await asyncio.to_thread(remove_temp_file, temp_path)
+        raise
     except Exception as e:
+        print(f"Error saving photo: {e}")
+        await asyncio.to_thread(remove_temp_file, temp_path)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to save photo"
         )
-    return file_path
+    return PHOTO_URL_PREFIX + relative_path
+
+
+def content_addressed_path(content_hash: str, file_extension: str) -> str:
+    # two levels of 256-way sharding keep every directory small
+    return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{file_extension}"
+
+
+def write_chunk(buffer, digest, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
 
 
-async def create_entry(data: EntryCreate, lot_id: int, photo_url: str) -> EntryRead:
+def store_photo(temp_path: str, file_path: str):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # same bytes as any file already there (e.g. a retried upload); replacing it rather than keeping it
+    # gives it a fresh mtime, so a cleanup of the last entry that used it leaves it alone
+    os.replace(temp_path, file_path)
+
+
+def remove_temp_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def create_entry(session: AsyncSession, data: EntryCreate, lot_id: int, photo_url: str) -> EntryRead:
     try:
-        async with new_session() as session:
-            entry_dict = data.model_dump()
-            entry_dict["photo_url"] = photo_url
-            entry_model = EntryOrm(**entry_dict, lot_id=lot_id)
-            session.add(entry_model)
-            await session.flush()
-            await session.commit()
-            entry = EntryRead.from_orm(entry_model)
-            await analysis.analyze_plant_data(lot_id)
-            return entry
+        entry_dict = data.model_dump()
+        entry_dict["photo_url"] = photo_url
+        entry_dict.update(await image_variants.create_variants(photo_url))
+        entry_model = EntryOrm(**entry_dict, lot_id=lot_id)
+        session.add(entry_model)
+        await session.flush()
+        await baselines.apply_entries(session, EntryOrm.id == entry_model.id, sign=1)
+        # the AI call takes seconds; the worker picks the job up once the burst of uploads settles
+        await analysis_queue.enqueue(session, lot_id)
+        await session.commit()
+        analysis_queue.wake()
+        return EntryRead.from_orm(entry_model)
     except AttributeError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -50,43 +118,63 @@ async def create_entry(data: EntryCreate, lot_id: int, photo_url: str) -> EntryR
         )
 
 
-async def get_entries(lot_id: int) -> List[EntryRead] | None:
+async def get_entries(session: AsyncSession, lot_id: int, limit: int | None = None,
+                      after: tuple[datetime, int] | None = None, since: datetime | None = None,
+                      until: datetime | None = None) -> List[EntryRead] | None:
     try:
-        async with new_session() as session:
-            result = await session.execute(
-                (select(EntryOrm).filter(EntryOrm.lot_id == lot_id))
-            )
-            entries = result.scalars().all()
-            if not entries:
-                return None
-            return [EntryRead.from_orm(entry) for entry in entries]
+        query = (
+            select(EntryOrm)
+            .filter(EntryOrm.lot_id == lot_id)
+            .order_by(EntryOrm.entry_date, EntryOrm.id)
+        )
+        if after is not None:
+            query = query.filter(tuple_(EntryOrm.entry_date, EntryOrm.id) > tuple_(*after))
+        if since is not None:
+            query = query.filter(EntryOrm.entry_date >= since)
+        if until is not None:
+            query = query.filter(EntryOrm.entry_date < until)
+        if limit is not None:
+            query = query.limit(limit)
+        result = await session.execute(query)
+        entries = result.scalars().all()
+        if not entries:
+            return None
+        return [EntryRead.from_orm(entry) for entry in entries]
     except Exception as e:
         print(f"Error fetching entries: {e}")
         return None
 
 
-async def delete_entry(lot_id: int, entry_id: int, user_id: int) -> dict:
-    lot_model = await lot.get_lot_detail(lot_id)
-    if not lot_model:
-        raise HTTPException(status_code=404, detail="Lot not found")
-    if lot_model.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Access Forbidden!")
+async def get_latest_entries(session: AsyncSession, lot_id: int, limit: int) -> List[EntryRead]:
+    result = await session.execute(
+        select(EntryOrm)
+        .filter(EntryOrm.lot_id == lot_id)
+        .order_by(EntryOrm.entry_date.desc(), EntryOrm.id.desc())
+        .limit(limit)
+    )
+    entries = result.scalars().all()
+    return [EntryRead.from_orm(entry) for entry in reversed(entries)]
+
+
+async def delete_entry(session: AsyncSession, lot_id: int, entry_id: int, user_id: int) -> dict:
+    await lot.check_lot_owner(session, lot_id, user_id, verify=True)
 
     try:
-        async with new_session() as session:
-            result = await session.execute(
-                select(EntryOrm).where(
-                    EntryOrm.id == entry_id,
-                    EntryOrm.lot_id == lot_id
-                )
+        result = await session.execute(
+            select(EntryOrm).where(
+                EntryOrm.id == entry_id,
+                EntryOrm.lot_id == lot_id
             )
-            entry = result.scalars().first()
+        )
+        entry = result.scalars().first()
 
-            if not entry:
-                raise HTTPException(status_code=404, detail="Entry not found in the specified lot")
+        if not entry:
+            raise HTTPException(status_code=404, detail="Entry not found in the specified lot")
 
-            await session.delete(entry)
-            await session.commit()
+        await baselines.apply_entries(session, EntryOrm.id == entry.id, sign=-1)
+        await session.delete(entry)
+        await session.commit()
+        await photo_cleanup.remove_unreferenced(session, [entry.photo_url])
 
         return {"detail": "Entry successfully deleted"}
 
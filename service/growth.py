@@ -0,0 +1,253 @@
+import os
+from datetime import datetime, timedelta
+from typing import List, NamedTuple
+
+import numpy as np
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from data.config import EntryOrm
+from models.growth import GrowthReport, GrowthAnomaly, SeriesPoint, GrowthSeriesResponse
+from service import lot, microgreen_library, baselines
+from tools import downsample as downsample_tools
+
+GROWTH_ANOMALY_Z = float(os.getenv("GROWTH_ANOMALY_Z", "3.5"))
+# a plant losing more than this share of its height between two entries is flagged
+HEIGHT_DROP_RATIO = float(os.getenv("GROWTH_HEIGHT_DROP_RATIO", "0.1"))
+MIN_SAMPLES_FOR_OUTLIERS = 4
+SECONDS_PER_DAY = 86400.0
+# how many history points the analysis prompt gets per metric, however long the journal is
+PROMPT_HISTORY_POINTS = int(os.getenv("GROWTH_PROMPT_HISTORY_POINTS", "12"))
+
+
+class GrowthSeries(NamedTuple):
+    entry_ids: np.ndarray
+    entry_dates: List[datetime]
+    days: np.ndarray
+    height: np.ndarray
+    moisture: np.ndarray
+
+
+def build_series(rows, sowing_date: datetime) -> GrowthSeries:
+    # rows are (id, entry_date, height, moisture) ordered by entry_date; days are counted from sowing
+    count = len(rows)
+    entry_dates = [row[1] for row in rows]
+    return GrowthSeries(
+        entry_ids=np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+        entry_dates=entry_dates,
+        days=np.fromiter(((date - sowing_date).total_seconds() / SECONDS_PER_DAY for date in entry_dates),
+                         dtype=np.float64, count=count),
+        height=np.fromiter((row[2] for row in rows), dtype=np.float64, count=count),
+        moisture=np.fromiter((row[3] for row in rows), dtype=np.float64, count=count),
+    )
+
+
+async def load_series(session: AsyncSession, lot_id: int, sowing_date: datetime, since: datetime | None = None,
+                      until: datetime | None = None) -> GrowthSeries:
+    query = (
+        select(EntryOrm.id, EntryOrm.entry_date, EntryOrm.height, EntryOrm.moisture)
+        .where(EntryOrm.lot_id == lot_id)
+        .order_by(EntryOrm.entry_date, EntryOrm.id)
+    )
+    if since is not None:
+        query = query.where(EntryOrm.entry_date >= since)
+    if until is not None:
+        query = query.where(EntryOrm.entry_date < until)
+    result = await session.execute(query)
+    return build_series(result.all(), sowing_date)
+
+
+def downsample(series: GrowthSeries, values: np.ndarray, points: int) -> List[SeriesPoint]:
+    selected = downsample_tools.lttb_indices(series.days, values, points)
+    low, high = downsample_tools.bucket_envelope(values, selected)
+    return [
+        SeriesPoint(entry_date=series.entry_dates[i], value=float(values[i]), min=float(lo), max=float(hi))
+        for i, lo, hi in zip(selected, low, high)
+    ]
+
+
+async def get_downsampled_series(session: AsyncSession, lot_id: int, user_id: int, points: int,
+                                 since: datetime | None = None, until: datetime | None = None) -> GrowthSeriesResponse:
+    await lot.check_lot_owner(session, lot_id, user_id)
+    lot_detail = await lot.get_lot_detail(session, lot_id)
+    series = await load_series(session, lot_id, lot_detail.sowing_date, since, until)
+    return GrowthSeriesResponse(
+        lot_id=lot_id,
+        samples=len(series.days),
+        height=downsample(series, series.height, points),
+        moisture=downsample(series, series.moisture, points),
+    )
+
+
+def robust_z(values: np.ndarray) -> np.ndarray:
+    # median/MAD z-score, so the outlier itself doesn't inflate the spread it is measured against
+    deviation = values - np.median(values)
+    mad = np.median(np.abs(deviation))
+    if mad > 0:
+        return 0.6745 * deviation / mad
+    mean_deviation = np.mean(np.abs(deviation))
+    if mean_deviation > 0:
+        return deviation / (1.2533 * mean_deviation)
+    return np.zeros_like(values)
+
+
+def find_anomalies(series: GrowthSeries, fitted: np.ndarray | None) -> List[GrowthAnomaly]:
+    flagged = []  # (index, metric, kind, value, expected)
+
+    if len(series.height) >= 2:
+        previous = series.height[:-1]
+        drops = np.flatnonzero((previous > 0) & (np.diff(series.height) < -HEIGHT_DROP_RATIO * previous)) + 1
+        flagged += [(i, "height", "height_drop", series.height[i], series.height[i - 1]) for i in drops]
+
+    if len(series.height) >= MIN_SAMPLES_FOR_OUTLIERS:
+        if fitted is not None:
+            outliers = np.flatnonzero(np.abs(robust_z(series.height - fitted)) > GROWTH_ANOMALY_Z)
+            flagged += [(i, "height", "height_outlier", series.height[i], fitted[i]) for i in outliers]
+
+        moisture_z = robust_z(series.moisture)
+        median = float(np.median(series.moisture))
+        for i in np.flatnonzero(np.abs(moisture_z) > GROWTH_ANOMALY_Z):
+            kind = "moisture_spike" if moisture_z[i] > 0 else "moisture_dip"
+            flagged.append((i, "moisture", kind, series.moisture[i], median))
+
+    return [
+        GrowthAnomaly(
+            entry_id=int(series.entry_ids[i]),
+            entry_date=series.entry_dates[i],
+            metric=metric,
+            kind=kind,
+            value=float(value),
+            expected=None if expected is None else round(float(expected), 3),
+        )
+        for i, metric, kind, value, expected in sorted(flagged, key=lambda item: item[0])
+    ]
+
+
+def analyze_series(lot_id: int, series: GrowthSeries, sowing_date: datetime, expected_harvest_date: datetime,
+                   days_to_grow: int | None, now: datetime | None = None) -> GrowthReport:
+    now = now or datetime.now()
+    samples = len(series.days)
+    species_harvest_date = sowing_date + timedelta(days=days_to_grow) if days_to_grow else None
+    projected_harvest_date = species_harvest_date or expected_harvest_date
+    expected_day = (expected_harvest_date - sowing_date).total_seconds() / SECONDS_PER_DAY
+
+    report = {}
+    fitted = None
+    distinct_days = len(np.unique(series.days))
+    if distinct_days >= 2:
+        slope, intercept = np.polyfit(series.days, series.height, 1)
+        fitted = slope * series.days + intercept
+        total = np.sum((series.height - series.height.mean()) ** 2)
+        residual = np.sum((series.height - fitted) ** 2)
+        report["growth_rate"] = round(float(slope), 4)
+        report["growth_fit_r2"] = round(float(1 - residual / total), 4) if total > 0 else 1.0
+        report["projected_height_at_harvest"] = round(
+            max(float(slope * expected_day + intercept), float(series.height[-1])), 3)
+
+    if distinct_days >= 3:
+        curvature, linear, _ = np.polyfit(series.days, series.height, 2)
+        report["growth_acceleration"] = round(float(2 * curvature), 4)
+        # a decelerating curve levels off at its vertex; that is when the shoots stop gaining height
+        if curvature < 0:
+            plateau_day = -linear / (2 * curvature)
+            reference_day = days_to_grow or expected_day
+            if series.days[-1] < plateau_day and 0.5 * reference_day <= plateau_day <= 2 * reference_day:
+                projected_harvest_date = sowing_date + timedelta(days=float(plateau_day))
+
+    if samples:
+        report["first_entry_date"] = series.entry_dates[0]
+        report["last_entry_date"] = series.entry_dates[-1]
+        report["height_current"] = float(series.height[-1])
+        report["moisture_mean"] = round(float(series.moisture.mean()), 3)
+        report["moisture_variance"] = round(float(series.moisture.var()), 3)
+        report["moisture_std"] = round(float(series.moisture.std()), 3)
+    if distinct_days >= 2:
+        report["moisture_trend"] = round(float(np.polyfit(series.days, series.moisture, 1)[0]), 4)
+
+    return GrowthReport(
+        lot_id=lot_id,
+        samples=samples,
+        days_since_sowing=round((now - sowing_date).total_seconds() / SECONDS_PER_DAY, 2),
+        anomalies=find_anomalies(series, fitted),
+        expected_harvest_date=expected_harvest_date,
+        species_harvest_date=species_harvest_date,
+        projected_harvest_date=projected_harvest_date,
+        projected_delay_days=round((projected_harvest_date - expected_harvest_date).total_seconds() / SECONDS_PER_DAY, 1),
+        **report,
+    )
+
+
+async def build_growth_report(session: AsyncSession, lot_id: int) -> GrowthReport:
+    lot_detail = await lot.get_lot_detail(session, lot_id)
+    if lot_detail is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lot not found")
+    series = await load_series(session, lot_id, lot_detail.sowing_date)
+    return await report_for_series(session, lot_detail, series)
+
+
+async def report_for_series(session: AsyncSession, lot_detail, series: GrowthSeries) -> GrowthReport:
+    microgreen = (await microgreen_library.get_catalog(session)).by_id.get(lot_detail.microgreen_id)
+    report = analyze_series(lot_detail.id, series, lot_detail.sowing_date, lot_detail.expected_harvest_date,
+                            microgreen.days_to_grow if microgreen else None)
+    if not report.samples:
+        return report
+    species = await baselines.compare(
+        session, lot_detail.microgreen_id,
+        baselines.day_since_sowing(lot_detail.sowing_date, series.entry_dates[-1]),
+        float(series.height[-1]), float(series.moisture[-1]),
+    )
+    return report.model_copy(update=species)
+
+
+async def get_growth_report(session: AsyncSession, lot_id: int, user_id: int) -> GrowthReport:
+    await lot.check_lot_owner(session, lot_id, user_id)
+    return await build_growth_report(session, lot_id)
+
+
+def history_line(label: str, points: List[SeriesPoint]) -> str:
+    return f"{label}: " + "; ".join(
+        f"{point.entry_date:%d.%m} {point.value:g}" + (f" ({point.min:g}–{point.max:g})" if point.min != point.max else "")
+        for point in points
+    )
+
+
+def growth_summary(report: GrowthReport, series: GrowthSeries | None = None) -> str:
+    # what the analysis prompt gets instead of the raw entry list
+    if not report.samples:
+        return "Записей пока нет."
+    lines = [
+        f"Записей: {report.samples} ({report.first_entry_date:%d.%m.%Y} – {report.last_entry_date:%d.%m.%Y}), "
+        f"дней с посева: {report.days_since_sowing:.1f}",
+        f"Текущая высота: {report.height_current:g}",
+    ]
+    if report.growth_rate is not None:
+        line = f"Скорость роста: {report.growth_rate:+.3f} в день (R² {report.growth_fit_r2:.2f})"
+        if report.growth_acceleration is not None:
+            line += f", ускорение {report.growth_acceleration:+.4f} в день²"
+        lines.append(line)
+    line = f"Влажность: среднее {report.moisture_mean:g}, дисперсия {report.moisture_variance:g}"
+    if report.moisture_trend is not None:
+        line += f", тренд {report.moisture_trend:+.3f} в день"
+    lines.append(line)
+    if report.anomalies:
+        lines.append("Аномалии: " + "; ".join(
+            f"{anomaly.entry_date:%d.%m} {anomaly.kind} {anomaly.value:g}" for anomaly in report.anomalies[-5:]
+        ))
+    lines.append(
+        f"Прогноз сбора по кривой роста: {report.projected_harvest_date:%d.%m.%Y} "
+        f"({report.projected_delay_days:+.1f} дн. к ожидаемой дате)"
+    )
+    if report.species_harvest_date is not None:
+        lines.append(f"Срок по культуре: {report.species_harvest_date:%d.%m.%Y}")
+    if series is not None and len(series.days) > 1:
+        lines.append(history_line("История высоты", downsample(series, series.height, PROMPT_HISTORY_POINTS)))
+        lines.append(history_line("История влажности", downsample(series, series.moisture, PROMPT_HISTORY_POINTS)))
+    if report.species_height is not None:
+        lines.append(
+            f"Та же культура на {report.species_day}-й день ({report.species_samples} измерений): "
+            f"высота p10–p50–p90 {report.species_height.p10:g}–{report.species_height.p50:g}–"
+            f"{report.species_height.p90:g}, этот лот на {report.species_height_percentile:g}-м перцентиле; "
+            f"влажность p50 {report.species_moisture.p50:g}, лот на {report.species_moisture_percentile:g}-м"
+        )
+    return "\n".join(lines)
@@ -1,83 +1,118 @@
+import os
+from cachetools import TTLCache
 from fastapi import HTTPException
-from sqlalchemy import select
+from sqlalchemy import select, delete
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+from datetime import datetime
 
-from data.config import new_session, LotOrm
+from data.config import LotOrm, EntryOrm
 from models.lot import LotCreate, LotCreateResponse, LotsGetResponse
+from service import baselines
+from tools import photo_cleanup
 
-async def create_lot(lot_data: LotCreate, user_id: int) -> LotCreateResponse:
-    async with new_session() as session:
-        new_lot = LotOrm(
-            user_id=user_id,
-            microgreen_id=lot_data.microgreen_id,
-            sowing_date=lot_data.sowing_date,
-            substrate_type=lot_data.substrate_type,
-            expected_harvest_date=lot_data.expected_harvest_date,
-        )
-        session.add(new_lot)
-        try:
-            await session.commit()
-        except IntegrityError:
-            await session.rollback()
-            raise HTTPException(status_code=400, detail="Error creating lot")
-        await session.refresh(new_lot)
-        return LotCreateResponse(id=new_lot.id)
-
-
-async def get_lots(user_id: int) -> List[LotOrm]:
-    async with new_session() as session:
-        query = (
-            select(LotOrm)
-            .where(LotOrm.user_id == user_id)
-            .options(selectinload(LotOrm.microgreen))
-        )
-        result = await session.execute(query)
-        lots = result.scalars().all()
-        return lots
-
-
-async def get_lot_detail(lot_id: int) -> Optional[LotOrm]:
-    async with new_session() as session:
-        query = (
-            select(LotOrm)
-            .where(LotOrm.id == lot_id)
-            .options(
-                selectinload(LotOrm.microgreen),
-                selectinload(LotOrm.entries)
-            )
-        )
-        result = await session.execute(query)
-        lot = result.scalars().first()
-        return lot
-
-
-async def delete_lot(lot_id: int, user_id: int) -> dict:
-    lot = await get_lot_detail(lot_id)
-    if not lot:
+# lot_id -> user_id. A lot never changes owner, but SQLite reuses the id of a deleted lot and other workers
+# never see this process's invalidations, so entries expire quickly and writes always go to the database
+LOT_OWNER_CACHE_TTL = int(os.getenv("LOT_OWNER_CACHE_TTL", "30"))
+owner_cache = TTLCache(maxsize=int(os.getenv("LOT_OWNER_CACHE_SIZE", "4096")), ttl=LOT_OWNER_CACHE_TTL)
+
+
+async def get_lot_owner(session: AsyncSession, lot_id: int, verify: bool = False) -> Optional[int]:
+    if not verify:
+        owner_id = owner_cache.get(lot_id)
+        if owner_id is not None:
+            return owner_id
+    result = await session.execute(select(LotOrm.user_id).where(LotOrm.id == lot_id))
+    owner_id = result.scalar()
+    if owner_id is not None:
+        owner_cache[lot_id] = owner_id
+    else:
+        owner_cache.pop(lot_id, None)
+    return owner_id
+
+
+async def check_lot_owner(session: AsyncSession, lot_id: int, user_id: int, detail: str = "Access Forbidden!",
+                          verify: bool = False):
+    # verify=True skips the cache; every path that changes a lot or its children passes it
+    owner_id = await get_lot_owner(session, lot_id, verify)
+    if owner_id is None:
         raise HTTPException(status_code=404, detail="Lot not found")
-    if lot.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Access Forbidden!")
+    if owner_id != user_id:
+        raise HTTPException(status_code=403, detail=detail)
+
+
+def invalidate_user_lots(user_id: int):
+    for lot_id in list(owner_cache.keys()):
+        if owner_cache.get(lot_id) == user_id:
+            owner_cache.pop(lot_id, None)
+
 
+async def create_lot(session: AsyncSession, lot_data: LotCreate, user_id: int) -> LotCreateResponse:
+    new_lot = LotOrm(
+        user_id=user_id,
+        microgreen_id=lot_data.microgreen_id,
+        sowing_date=lot_data.sowing_date,
+        substrate_type=lot_data.substrate_type,
+        expected_harvest_date=lot_data.expected_harvest_date,
+    )
+    session.add(new_lot)
     try:
-        async with new_session() as session:
-            result = await session.execute(
-                select(LotOrm).where(
-                    LotOrm.id == lot_id,
-                    LotOrm.id == lot_id
-                )
-            )
-            lot = result.scalars().first()
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=400, detail="Error creating lot")
+    await session.refresh(new_lot)
+    # SQLite may reuse the id of a deleted lot, so never trust an older entry in this process
+    owner_cache[new_lot.id] = user_id
+    return LotCreateResponse(id=new_lot.id)
 
-            if not lot:
-                raise HTTPException(status_code=404, detail="Lot not found")
 
-            await session.delete(lot)
-            await session.commit()
+async def get_lots(session: AsyncSession, user_id: int, limit: int | None = None, after_id: int | None = None,
+                   since: datetime | None = None, until: datetime | None = None) -> List[LotOrm]:
+    query = (
+        select(LotOrm)
+        .where(LotOrm.user_id == user_id)
+        .order_by(LotOrm.id)
+    )
+    if after_id is not None:
+        query = query.where(LotOrm.id > after_id)
+    if since is not None:
+        query = query.where(LotOrm.sowing_date >= since)
+    if until is not None:
+        query = query.where(LotOrm.sowing_date < until)
+    if limit is not None:
+        query = query.limit(limit)
+    result = await session.execute(query)
+    lots = result.scalars().all()
+    return lots
+
+
+async def get_lot_detail(session: AsyncSession, lot_id: int) -> Optional[LotOrm]:
+    query = (
+        select(LotOrm)
+        .where(LotOrm.id == lot_id)
+    )
+    result = await session.execute(query)
+    lot = result.scalars().first()
+    return lot
+
+
+async def delete_lot(session: AsyncSession, lot_id: int, user_id: int) -> dict:
+    await check_lot_owner(session, lot_id, user_id, verify=True)
+
+    try:
+        result = await session.execute(select(EntryOrm.photo_url).where(EntryOrm.lot_id == lot_id))
+        photo_urls = result.scalars().all()
+        await baselines.apply_entries(session, EntryOrm.lot_id == lot_id, sign=-1)
+        # entries and notifications go with it through ON DELETE CASCADE
+        await session.execute(delete(LotOrm).where(LotOrm.id == lot_id))
+        await session.commit()
+        owner_cache.pop(lot_id, None)
+        await photo_cleanup.remove_unreferenced(session, photo_urls)
 
         return {"detail": "Lot successfully deleted"}
 
     except Exception as e:
         print(f"Error deleting lot: {e}")
-        raise HTTPException(status_code=500, detail="Failed to delete lot")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to delete lot")
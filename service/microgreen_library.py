@@ -1,17 +1,66 @@
+import hashlib
+import json
+import os
+import time
+from types import MappingProxyType
+from typing import List, Mapping, NamedTuple
+
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from data.config import new_session, MicrogreenOrm
 from models.microgreen_library import MicrogreenRead
 
+CATALOG_TTL = int(os.getenv("CATALOG_TTL", "300"))
+
+
+class MicrogreenCatalog(NamedTuple):
+    items: tuple
+    by_id: Mapping[int, MicrogreenRead]
+    by_name: Mapping[str, MicrogreenRead]
+    body: bytes
+    etag: str
+    loaded_at: float
+
+
+# the library is seeded once and read on nearly every screen, so it is served from memory
+catalog: MicrogreenCatalog | None = None
+
+
+def build_catalog(microgreens: List[MicrogreenRead]) -> MicrogreenCatalog:
+    items = tuple(sorted(microgreens, key=lambda microgreen: microgreen.id))
+    body = json.dumps([item.model_dump() for item in items], ensure_ascii=False, separators=(",", ":")).encode()
+    return MicrogreenCatalog(
+        items=items,
+        by_id=MappingProxyType({item.id: item for item in items}),
+        by_name=MappingProxyType({item.name.lower(): item for item in items}),
+        body=body,
+        etag=f'"{hashlib.sha1(body).hexdigest()}"',
+        loaded_at=time.monotonic(),
+    )
 
-async def get_microgreens() -> List[MicrogreenRead] | None:
+
+async def refresh_catalog(session: AsyncSession) -> MicrogreenCatalog:
+    global catalog
+    result = await session.execute(select(MicrogreenOrm))
+    fresh = build_catalog([MicrogreenRead.from_orm(i) for i in result.scalars().all()])
+    if catalog is not None and catalog.etag == fresh.etag:
+        # table unchanged: keep the same objects, only push the next revalidation back
+        fresh = catalog._replace(loaded_at=fresh.loaded_at)
+    catalog = fresh
+    return catalog
+
+
+async def load_catalog() -> MicrogreenCatalog:
     async with new_session() as session:
-        query = (
-            select(MicrogreenOrm)
-        )
-        result = await session.execute(query)
-        microgreen_models = result.scalars().all()
-        microgreens = [MicrogreenRead.from_orm(i) for i in microgreen_models]
-        return microgreens
+        return await refresh_catalog(session)
+
+
+async def get_catalog(session: AsyncSession) -> MicrogreenCatalog:
+    if catalog is None or time.monotonic() - catalog.loaded_at > CATALOG_TTL:
+        return await refresh_catalog(session)
+    return catalog
+
+
+async def get_microgreens(session: AsyncSession) -> List[MicrogreenRead] | None:
+    return list((await get_catalog(session)).items)
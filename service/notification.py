@@ -1,71 +1,74 @@
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
+from datetime import datetime
 from fastapi import HTTPException, status
-from data.config import new_session, NotificationOrm
+from data.config import NotificationOrm
 from models.notification import ReadNotification, CreateNotification
-from service import lot
+from service import lot, push_scheduler
 
 
-async def create_notification(data: CreateNotification, lot_id: int, user_id: int) -> ReadNotification | None:
-    lot_model = await lot.get_lot_detail(lot_id)
-    if not lot_model:
-        raise HTTPException(status_code=404, detail="Lot not found")
-    if lot_model.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Access Forbidden!")
+async def create_notification(session: AsyncSession, data: CreateNotification, lot_id: int,
+                              user_id: int) -> ReadNotification | None:
+    await lot.check_lot_owner(session, lot_id, user_id, verify=True)
     try:
-        async with new_session() as session:
-            entry_dict = data.model_dump()
-            entry_model = NotificationOrm(**entry_dict, lot_id=lot_id)
-            session.add(entry_model)
-            await session.flush()
-            await session.commit()
-            entry = ReadNotification.from_orm(entry_model)
-            return entry
+        entry_dict = data.model_dump()
+        # stored as naive UTC, the same value the timer and the claim query compare against
+        entry_dict["scheduled_at"] = push_scheduler.as_utc(entry_dict["scheduled_at"])
+        entry_model = NotificationOrm(**entry_dict, lot_id=lot_id)
+        session.add(entry_model)
+        await session.flush()
+        await session.commit()
+        push_scheduler.schedule(entry_model.id, entry_model.scheduled_at)
+        entry = ReadNotification.from_orm(entry_model)
+        return entry
     except Exception as e:
         print(f"Error creating notification: {e}")
         raise HTTPException(status_code=500, detail="Failed to create notification")
 
 
-async def get_notifications(lot_id: int, user_id: int) -> List[ReadNotification] | None:
-    lot_model = await lot.get_lot_detail(lot_id)
-    if not lot_model:
-        raise HTTPException(status_code=404, detail="Lot not found")
-    if lot_model.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Access Forbidden!")
+async def get_notifications(session: AsyncSession, lot_id: int, user_id: int, limit: int | None = None,
+                            after_id: int | None = None, since: datetime | None = None,
+                            until: datetime | None = None) -> List[ReadNotification] | None:
+    await lot.check_lot_owner(session, lot_id, user_id)
     try:
-        async with new_session() as session:
-            result = await session.execute(select(NotificationOrm).filter(NotificationOrm.lot_id == lot_id))
-            entries = result.scalars().all()
+        query = select(NotificationOrm).filter(NotificationOrm.lot_id == lot_id).order_by(NotificationOrm.id)
+        if after_id is not None:
+            query = query.filter(NotificationOrm.id > after_id)
+        if since is not None:
+            query = query.filter(NotificationOrm.scheduled_at >= since)
+        if until is not None:
+            query = query.filter(NotificationOrm.scheduled_at < until)
+        if limit is not None:
+            query = query.limit(limit)
+        result = await session.execute(query)
+        entries = result.scalars().all()
 
-            if not entries:
-                return []
+        if not entries:
+            return []
 
-            return [ReadNotification.from_orm(entry) for entry in entries]
+        return [ReadNotification.from_orm(entry) for entry in entries]
     except Exception as e:
         print(f"Error fetching notifications: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch notifications")
 
 
-async def delete_notification(lot_id: int, notification_id: int, user_id: int) -> dict:
-    lot_model = await lot.get_lot_detail(lot_id)
-    if not lot_model:
-        raise HTTPException(status_code=404, detail="Lot not found")
-    if lot_model.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Access Forbidden!")
+async def delete_notification(session: AsyncSession, lot_id: int, notification_id: int, user_id: int) -> dict:
+    await lot.check_lot_owner(session, lot_id, user_id, verify=True)
 
-    async with new_session() as session:
-        result = await session.execute(
-            select(NotificationOrm).where(
-                NotificationOrm.id == notification_id,
-                NotificationOrm.lot_id == lot_id
-            )
+    result = await session.execute(
+        select(NotificationOrm).where(
+            NotificationOrm.id == notification_id,
+            NotificationOrm.lot_id == lot_id
         )
-        notification = result.scalars().first()
+    )
+    notification = result.scalars().first()
 
-        if not notification:
-            raise HTTPException(status_code=404, detail="Notification not found in the specified lot")
+    if not notification:
+        raise HTTPException(status_code=404, detail="Notification not found in the specified lot")
 
-        await session.delete(notification)
-        await session.commit()
+    await session.delete(notification)
+    await session.commit()
+    push_scheduler.cancel(notification_id)
 
     return {"detail": "Notification successfully deleted"}
@@ -1,54 +1,369 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from datetime import datetime
-from sqlalchemy import select
-from data.config import new_session, NotificationOrm, LotOrm, UserOrm
-
-from exponent_server_sdk import PushClient, PushMessage
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, delete, and_, or_
+from sqlalchemy.orm import aliased
+from data.config import new_session, NotificationOrm, LotOrm, UserOrm, PushTicketOrm
 import asyncio
+import heapq
+import os
+import socket
+import uuid
 
-async def send_expo_notification(expo_push_token: str, body: str):
-    message = PushMessage(
-        to=expo_push_token,
-        title="notification",
-        body=body,
-    )
-    try:
-        result = await asyncio.to_thread(lambda: PushClient().publish(message))
-        return result
-    except Exception as e:
-        print(f"Error sending push notification: {e}")
-        return None
+# Expo accepts at most 100 messages per request
+PUSH_CHUNK_SIZE = int(os.getenv("PUSH_CHUNK_SIZE", "100"))
+PUSH_CONCURRENCY = int(os.getenv("PUSH_CONCURRENCY", "4"))
+# due notifications loaded per round trip; a tick keeps going until nothing due is left
+PUSH_BATCH_SIZE = int(os.getenv("PUSH_BATCH_SIZE", "2000"))
+# stays under SQLite's bound-parameter limit
+UPDATE_CHUNK_SIZE = 500
+# longer than a batch takes to send; a worker that dies mid-batch gives its rows up after this
+PUSH_LEASE_SECONDS = int(os.getenv("PUSH_LEASE_SECONDS", "120"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+# the timer covers this process's own notifications; the poll picks up ones other workers created and retries failures
+PUSH_SAFETY_NET_MINUTES = int(os.getenv("PUSH_SAFETY_NET_MINUTES", "10"))
 
-async def check_and_send_notifications():
+# unset means exp.host; point it at tools/fake_expo.py to run the whole flow offline
+EXPO_HOST = os.getenv("EXPO_HOST")
+EXPO_ACCESS_TOKEN = os.getenv("EXPO_ACCESS_TOKEN")
+PUSH_HTTP_TIMEOUT = float(os.getenv("PUSH_HTTP_TIMEOUT", "30"))
+# Expo has receipts ready about 15 minutes after sending and drops them after a day
+PUSH_RECEIPT_DELAY_MINUTES = int(os.getenv("PUSH_RECEIPT_DELAY_MINUTES", "15"))
+PUSH_RECEIPT_INTERVAL_MINUTES = int(os.getenv("PUSH_RECEIPT_INTERVAL_MINUTES", "15"))
+PUSH_RECEIPT_TTL_HOURS = 24
+# Expo's limit for one getReceipts request
+RECEIPT_BATCH_SIZE = 1000
+DEVICE_NOT_REGISTERED = "DeviceNotRegistered"
+# Expo asks for these to be sent again later; any other ticket error fails the same way every time
+RETRYABLE_TICKET_ERRORS = {"MessageRateExceeded"}
+# claims before a notification Expo keeps rejecting is given up on
+PUSH_MAX_ATTEMPTS = int(os.getenv("PUSH_MAX_ATTEMPTS", "10"))
+
+# (scheduled_at, notification_id) of undelivered notifications; deadlines holds the live entry per id
+timers: list = []
+deadlines: dict[int, datetime] = {}
+wakeup = asyncio.Event()
+send_lock = asyncio.Lock()
+timer_task: asyncio.Task | None = None
+scheduler: AsyncIOScheduler | None = None
+push_client = None
+
+
+def as_utc(moment: datetime) -> datetime:
+    # scheduled_at is stored as naive UTC
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def schedule(notification_id: int, scheduled_at: datetime):
+    scheduled_at = as_utc(scheduled_at)
+    deadlines[notification_id] = scheduled_at
+    heapq.heappush(timers, (scheduled_at, notification_id))
+    wakeup.set()
+
+
+def cancel(notification_id: int):
+    # the heap entry is dropped lazily when it reaches the top
+    deadlines.pop(notification_id, None)
+    wakeup.set()
+
+
+def next_deadline() -> datetime | None:
+    while timers and deadlines.get(timers[0][1]) != timers[0][0]:
+        heapq.heappop(timers)
+    return timers[0][0] if timers else None
+
+
+def pop_due(now: datetime):
+    while (deadline := next_deadline()) is not None and deadline <= now:
+        _, notification_id = heapq.heappop(timers)
+        deadlines.pop(notification_id, None)
+
+
+async def load_timers():
     async with new_session() as session:
-        query = select(NotificationOrm).where(
-            NotificationOrm.scheduled_at <= datetime.utcnow(),
-            NotificationOrm.is_delivered == False
+        result = await session.execute(
+            select(NotificationOrm.id, NotificationOrm.scheduled_at)
+            .where(NotificationOrm.is_delivered == False, NotificationOrm.delivery_error.is_(None))
         )
+        for notification_id, scheduled_at in result.all():
+            deadlines[notification_id] = scheduled_at
+            timers.append((scheduled_at, notification_id))
+    heapq.heapify(timers)
 
-        result = await session.execute(query)
-        notifications = result.scalars().all()
-
-        for notif in notifications:
-            lot = await session.get(LotOrm, notif.lot_id)
-            if not lot:
-                continue
-            user = await session.get(UserOrm, lot.user_id)
-            if not user or not user.expo_push_token:
-                print(f"User {lot.user_id} has no expo push token")
-                continue
-
-            body = notif.message
-            result = await send_expo_notification(user.expo_push_token, body)
-            if result and result.get("success", False):
-                notif.is_delivered = True
+
+def chunked(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def get_push_client():
+    # one client and one keep-alive connection pool for every send and receipt check
+    global push_client
+    if push_client is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from exponent_server_sdk import PushClient
+
+        session = requests.Session()
+        session.headers.update({
+            "accept": "application/json",
+            "accept-encoding": "gzip, deflate",
+            "content-type": "application/json",
+        })
+        if EXPO_ACCESS_TOKEN:
+            session.headers["Authorization"] = f"Bearer {EXPO_ACCESS_TOKEN}"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PUSH_CONCURRENCY)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        push_client = PushClient(host=EXPO_HOST, session=session, timeout=PUSH_HTTP_TIMEOUT)
+    return push_client
+
+
+def ticket_error(response) -> str | None:
+    return (response.details or {}).get("error")
+
+
+def is_device_not_registered(response) -> bool:
+    return ticket_error(response) == DEVICE_NOT_REGISTERED
+
+
+async def send_expo_notifications(due: list) -> tuple[list[int], list[tuple[str, str]], set[str], dict[int, str]]:
+    # due is [(notification_id, expo_push_token, body)]
+    # returns the ids Expo accepted, their (ticket id, token) for the receipt check, tokens Expo rejected outright,
+    # and {notification_id: error} for messages Expo will never accept
+    from exponent_server_sdk import PushClient, PushMessage
+
+    client = get_push_client()
+    slots = asyncio.Semaphore(PUSH_CONCURRENCY)
+    delivered, tickets, dead_tokens, failed = [], [], set(), {}
+    # the SDK refuses the whole request over one malformed token, so those never reach a chunk
+    sendable = []
+    for item in due:
+        if PushClient.is_exponent_push_token(item[1]):
+            sendable.append(item)
+        else:
+            dead_tokens.add(item[1])
+
+    async def send(chunk: list):
+        messages = [PushMessage(to=token, title="notification", body=body) for _, token, body in chunk]
+        async with slots:
+            try:
+                responses = await asyncio.to_thread(client.publish_multiple, messages)
+            except Exception as e:
+                print(f"Error sending push notifications: {e}")
+                return
+        for (notification_id, token, _), ticket in zip(chunk, responses):
+            if ticket.is_success():
+                delivered.append(notification_id)
+                if ticket.id:
+                    tickets.append((ticket.id, token))
+            elif is_device_not_registered(ticket):
+                dead_tokens.add(token)
+            elif ticket_error(ticket) in RETRYABLE_TICKET_ERRORS:
+                print(f"Expo deferred notification {notification_id}: {ticket.message}")
             else:
-                print(f"Failed to send notification {notif.id}")
+                print(f"Failed to send notification {notification_id}: {ticket.message}")
+                # MessageTooBig, InvalidCredentials and the like; sending again can't help
+                failed[notification_id] = ticket_error(ticket) or ticket.message or "error"
+
+    await asyncio.gather(*(send(chunk) for chunk in chunked(sendable, PUSH_CHUNK_SIZE)))
+    return delivered, tickets, dead_tokens, failed
+
+
+async def clear_dead_tokens(session, tokens: set[str]):
+    # only rows still holding the dead token; a user who registered a new device meanwhile keeps it
+    for chunk in chunked(list(tokens), UPDATE_CHUNK_SIZE):
+        await session.execute(
+            update(UserOrm).where(UserOrm.expo_push_token.in_(chunk)).values(expo_push_token=None)
+        )
+    if tokens:
+        print(f"Cleared {len(tokens)} unregistered push tokens")
 
+
+def claimable(notification, now: datetime):
+    return and_(
+        notification.is_delivered == False,
+        notification.delivery_error.is_(None),
+        notification.send_attempts < PUSH_MAX_ATTEMPTS,
+        or_(notification.lease_expires_at.is_(None), notification.lease_expires_at < now),
+    )
+
+
+async def claim_due_notifications(session, now: datetime) -> tuple[str, list]:
+    # one UPDATE takes the batch, so concurrent workers (processes or replicas) never get the same row
+    claim = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+    candidate = aliased(NotificationOrm)
+    due_ids = (
+        select(candidate.id)
+        .join(LotOrm, candidate.lot_id == LotOrm.id)
+        .join(UserOrm, LotOrm.user_id == UserOrm.id)
+        .where(
+            candidate.scheduled_at <= now,
+            claimable(candidate, now),
+            # users without a token stay undelivered until they register one
+            UserOrm.expo_push_token.is_not(None),
+        )
+        .order_by(candidate.id)
+        .limit(PUSH_BATCH_SIZE)
+    )
+    await session.execute(
+        update(NotificationOrm)
+        # re-checked on the row itself, so a row claimed meanwhile by someone else is skipped
+        .where(NotificationOrm.id.in_(due_ids), claimable(NotificationOrm, now))
+        .values(lease_owner=claim, lease_expires_at=now + timedelta(seconds=PUSH_LEASE_SECONDS),
+                send_attempts=NotificationOrm.send_attempts + 1)
+    )
+    await session.commit()
+
+    result = await session.execute(
+        select(NotificationOrm.id, UserOrm.expo_push_token, NotificationOrm.message)
+        .join(LotOrm, NotificationOrm.lot_id == LotOrm.id)
+        .join(UserOrm, LotOrm.user_id == UserOrm.id)
+        .where(NotificationOrm.lease_owner == claim)
+        .order_by(NotificationOrm.id)
+    )
+    due = [tuple(row) for row in result.all()]
+    # end the read transaction before the slow part, so SQLite writers aren't held up
+    await session.commit()
+    return claim, due
+
+
+async def mark_delivered(session, notification_ids: list[int], claim: str):
+    for chunk in chunked(notification_ids, UPDATE_CHUNK_SIZE):
+        await session.execute(
+            update(NotificationOrm)
+            .where(NotificationOrm.id.in_(chunk), NotificationOrm.lease_owner == claim)
+            .values(is_delivered=True, lease_owner=None, lease_expires_at=None)
+        )
+    await session.commit()
+
+
+async def mark_failed(session, failed: dict[int, str], claim: str):
+    for notification_id, error in failed.items():
+        await session.execute(
+            update(NotificationOrm)
+            .where(NotificationOrm.id == notification_id, NotificationOrm.lease_owner == claim)
+            .values(delivery_error=error, lease_owner=None, lease_expires_at=None)
+        )
+    await session.commit()
+
+
+async def check_and_send_notifications():
+    # leases already keep rows from being sent twice; the lock just saves this process a pointless second claim
+    async with send_lock:
+        await send_due_notifications()
+
+
+async def send_due_notifications():
+    async with new_session() as session:
+        while True:
+            claim, due = await claim_due_notifications(session, datetime.utcnow())
+            if not due:
+                break
+            delivered, tickets, dead_tokens, failed = await send_expo_notifications(due)
+            now = datetime.utcnow()
+            session.add_all([
+                PushTicketOrm(ticket_id=ticket_id, expo_push_token=token, created_at=now)
+                for ticket_id, token in tickets
+            ])
+            await clear_dead_tokens(session, dead_tokens)
+            # rows Expo will never accept stop here; the rest keep their lease and are retried once it expires,
+            # up to PUSH_MAX_ATTEMPTS claims
+            await mark_failed(session, failed, claim)
+            await mark_delivered(session, delivered, claim)
+            if len(due) < PUSH_BATCH_SIZE:
+                break
+
+
+async def check_push_receipts():
+    from exponent_server_sdk import PushTicket
+
+    client = get_push_client()
+    async with new_session() as session:
+        await session.execute(
+            delete(PushTicketOrm)
+            .where(PushTicketOrm.created_at < datetime.utcnow() - timedelta(hours=PUSH_RECEIPT_TTL_HOURS))
+        )
         await session.commit()
+        after_id = 0
+        while True:
+            result = await session.execute(
+                select(PushTicketOrm.id, PushTicketOrm.ticket_id, PushTicketOrm.expo_push_token)
+                .where(PushTicketOrm.id > after_id,
+                       PushTicketOrm.created_at <= datetime.utcnow() - timedelta(minutes=PUSH_RECEIPT_DELAY_MINUTES))
+                .order_by(PushTicketOrm.id)
+                .limit(RECEIPT_BATCH_SIZE)
+            )
+            rows = result.all()
+            await session.commit()
+            if not rows:
+                break
+            token_by_ticket = {ticket_id: token for _, ticket_id, token in rows}
+            try:
+                receipts = await asyncio.to_thread(
+                    client.check_receipts_multiple,
+                    [PushTicket(None, PushTicket.SUCCESS_STATUS, "", None, ticket_id) for ticket_id in token_by_ticket]
+                )
+            except Exception as e:
+                print(f"Error checking push receipts: {e}")
+                return
+
+            dead_tokens = set()
+            for receipt in receipts:
+                if is_device_not_registered(receipt) and receipt.id in token_by_ticket:
+                    dead_tokens.add(token_by_ticket[receipt.id])
+                elif not receipt.is_success():
+                    print(f"Push receipt {receipt.id} failed: {receipt.message}")
+            await clear_dead_tokens(session, dead_tokens)
+            # tickets without a receipt yet stay for the next run, until the TTL above drops them
+            await session.execute(
+                delete(PushTicketOrm).where(PushTicketOrm.ticket_id.in_([receipt.id for receipt in receipts]))
+            )
+            await session.commit()
+            if len(rows) < RECEIPT_BATCH_SIZE:
+                break
+            after_id = rows[-1][0]
+
+
+async def timer_loop():
+    await load_timers()
+    while True:
+        wakeup.clear()
+        deadline = next_deadline()
+        if deadline is not None and deadline <= datetime.utcnow():
+            # anything that fails stays undelivered and is picked up again once its lease expires
+            pop_due(datetime.utcnow())
+            try:
+                await check_and_send_notifications()
+            except Exception as e:
+                print(f"Error sending due notifications: {e}")
+            continue
+        timeout = (deadline - datetime.utcnow()).total_seconds() if deadline is not None else None
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
 
 def start_scheduler():
+    global scheduler, timer_task
+    timer_task = asyncio.create_task(timer_loop())
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(check_and_send_notifications, 'interval', minutes=1)
+    # a tick that overruns the interval is skipped, not stacked
+    scheduler.add_job(check_and_send_notifications, 'interval', minutes=PUSH_SAFETY_NET_MINUTES,
+                      max_instances=1, coalesce=True)
+    scheduler.add_job(check_push_receipts, 'interval', minutes=PUSH_RECEIPT_INTERVAL_MINUTES,
+                      max_instances=1, coalesce=True)
     scheduler.start()
     print("Push scheduler started.")
+
+
+async def stop_scheduler():
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+    if timer_task is not None:
+        timer_task.cancel()
+        await asyncio.gather(timer_task, return_exceptions=True)
+    if push_client is not None:
+        push_client.session.close()
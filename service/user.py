@@ -1,20 +1,31 @@
 from datetime import datetime, timedelta
+from cachetools import TTLCache
 from sqlalchemy import select
-from data.config import new_session, UserOrm
+from sqlalchemy.ext.asyncio import AsyncSession
+from data.config import UserOrm, LotOrm, EntryOrm
 from models.user import LoginRequest, User, Password
-import bcrypt
 import jwt
 import os
+import time
 from fastapi import HTTPException, status
+from tools import password_hasher
+from service import lot, baselines
+from tools import photo_cleanup
 
 SECRET_KEY = str(os.getenv("SECRET_KEY"))
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 
+# token -> (user_id, email, exp); lets repeated requests skip the JWT decode and user lookup.
+# Invalidation only reaches this process: on other workers a deleted account's token keeps reading for up to
+# the TTL, and writes re-check that the cached id still belongs to the token's email (SQLite reuses user ids).
+token_cache = TTLCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "1024")),
+    ttl=int(os.getenv("TOKEN_CACHE_TTL", "60"))
+)
 
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed_password.decode('utf-8')
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash_password(password)
 
 
 def create_jwt_token(data: dict):
@@ -25,73 +36,107 @@ def create_jwt_token(data: dict):
     return encoded_jwt
 
 
-async def verify_token(token: str) -> UserOrm | None:
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-        if not email:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token.")
-        user = await find_user_by_email(email)
-        if not user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token.")
-        return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has expired")
     except jwt.DecodeError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token.")
+    if not payload.get("sub"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token.")
+    return payload
+
+
+async def verify_token(session: AsyncSession, token: str) -> UserOrm | None:
+    payload = decode_token(token)
+    user = await find_user_by_email(session, payload["sub"])
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token.")
+    return user
+
+
+async def verify_token_user_id(session: AsyncSession, token: str, verify: bool = False) -> int:
+    cached = token_cache.get(token)
+    if cached:
+        user_id, email, expire = cached
+        if expire > time.time() and (not verify or await is_user_email(session, user_id, email)):
+            return user_id
+        token_cache.pop(token, None)
+
+    payload = decode_token(token)
+    user = await find_user_by_email(session, payload["sub"])
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token.")
+    token_cache[token] = (int(user.id), user.email, payload.get("exp", 0))
+    return int(user.id)
+
 
+async def is_user_email(session: AsyncSession, user_id: int, email: str) -> bool:
+    result = await session.execute(select(UserOrm.email).where(UserOrm.id == user_id))
+    return result.scalar() == email
 
-async def register(data: LoginRequest) -> User:
-    if await is_email_exists(data):
+
+def invalidate_user_tokens(user_id: int):
+    for token in list(token_cache.keys()):
+        cached = token_cache.get(token)
+        if cached and cached[0] == user_id:
+            token_cache.pop(token, None)
+
+
+async def register(session: AsyncSession, data: LoginRequest) -> User:
+    if await is_email_exists(session, data):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="This email is already in use"
         )
-    async with new_session() as session:
-        user_dict = {
-            "email": data.email,
-            "hashed_password": hash_password(data.password)
-        }
-
-        user = UserOrm(**user_dict)
-        session.add(user)
-        await session.flush()
+    user_dict = {
+        "email": data.email,
+        "hashed_password": await hash_password(data.password)
+    }
+
+    user = UserOrm(**user_dict)
+    session.add(user)
+    await session.flush()
+    await session.commit()
+    user = User.from_orm(user)
+    return user
+
+
+async def find_user_by_email(session: AsyncSession, email: str) -> UserOrm | None:
+    query = select(UserOrm).where(UserOrm.email == email)
+    result = await session.execute(query)
+    user_model = result.scalars().first()
+    return user_model
+
+
+async def find_user(session: AsyncSession, user: LoginRequest) -> bool:
+    query = select(UserOrm).where(UserOrm.email == user.email)
+    result = await session.execute(query)
+    user_model = result.scalars().first()
+    if user_model is None:
+        return False
+    user_data = User.from_orm(user_model)
+    if not await password_hasher.check_password(user.password, user_data.hashed_password):
+        return False
+    # hashes made with an older cost are upgraded on the next successful login
+    if password_hasher.needs_rehash(user_data.hashed_password):
+        user_model.hashed_password = await hash_password(user.password)
         await session.commit()
-        user = User.from_orm(user)
-        return user
-
-
-async def find_user_by_email(email: str) -> UserOrm | None:
-    async with new_session() as session:
-        query = select(UserOrm).where(UserOrm.email == email)
-        result = await session.execute(query)
-        user_model = result.scalars().first()
-        return user_model
+    return True
 
 
-async def find_user(user: LoginRequest) -> bool:
-    async with new_session() as session:
-        query = select(UserOrm).where(UserOrm.email == user.email)
-        result = await session.execute(query)
-        user_model = result.scalars().first()
-        if user_model is None:
-            return False
-        user_data = User.from_orm(user_model)
-        return bcrypt.checkpw(user.password.encode('utf-8'), user_data.hashed_password.encode('utf-8'))
+async def is_email_exists(session: AsyncSession, user: LoginRequest) -> bool:
+    query = select(UserOrm).where(UserOrm.email == user.email)
+    result = await session.execute(query)
+    user_model = result.scalars().first()
+    if user_model is None:
+        return False
+    return True
 
 
-async def is_email_exists(user: LoginRequest) -> bool:
-    async with new_session() as session:
-        query = select(UserOrm).where(UserOrm.email == user.email)
-        result = await session.execute(query)
-        user_model = result.scalars().first()
-        if user_model is None:
-            return False
-        return True
-
-
-async def login(data: LoginRequest) -> dict | None:
-    if not await find_user(data):
+async def login(session: AsyncSession, data: LoginRequest) -> dict | None:
+    if not await find_user(session, data):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -101,18 +146,25 @@ async def login(data: LoginRequest) -> dict | None:
     return {"token": token, "token_type": "bearer"}
 
 
-async def delete(password: Password, token: str) -> dict:
-    user_model = await verify_token(token)
-    if not bcrypt.checkpw(password.password.encode('utf-8'), user_model.hashed_password.encode('utf-8')):
+async def delete(session: AsyncSession, password: Password, token: str) -> dict:
+    user_model = await verify_token(session, token)
+    if not await password_hasher.check_password(password.password, user_model.hashed_password):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="Incorrect password. Account deletion failed.")
-    async with new_session() as session:
-        await session.delete(user_model)
-        await session.flush()
-        await session.commit()
-        return {"detail": "Your account has been deleted successfully."}
-
-
-async def checkme(token):
-    UserModel = await verify_token(token)
+    result = await session.execute(
+        select(EntryOrm.photo_url).join(LotOrm, EntryOrm.lot_id == LotOrm.id).where(LotOrm.user_id == user_model.id)
+    )
+    photo_urls = result.scalars().all()
+    await baselines.apply_entries(session, LotOrm.user_id == user_model.id, sign=-1)
+    await session.delete(user_model)
+    await session.flush()
+    await session.commit()
+    invalidate_user_tokens(user_model.id)
+    lot.invalidate_user_lots(user_model.id)
+    await photo_cleanup.remove_unreferenced(session, photo_urls)
+    return {"detail": "Your account has been deleted successfully."}
+
+
+async def checkme(session: AsyncSession, token):
+    UserModel = await verify_token(session, token)
     return {"detail": f"Hello! {UserModel.email}"}
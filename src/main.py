@@ -1,48 +1,56 @@
-import os
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
-from data.config import create_tables, delete_tables, seed_microgreens_library
-from service.push_scheduler import start_scheduler
-from web import user, lot, entry, microgreen_library, notification, analysis, push_token
+from data.config import delete_tables, seed_microgreens_library, STATIC_DIR, MAX_REQUEST_BODY
+from data.migrations import run_migrations
+from service.microgreen_library import load_catalog
+from service.push_scheduler import start_scheduler, stop_scheduler
+from web import user, lot, entry, microgreen_library, notification, analysis, push_token, growth, metrics
 from tools.аuthMiddleware import AuthMiddleware
+from tools.body_limit import BodySizeLimitMiddleware
+from tools import image_variants
+from service import analysis_queue
+from tools.static_files import PhotoStaticFiles
 
 load_dotenv()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await create_tables()
+    await run_migrations()
     print("База готова к работе")
 
     from data.config import seed_microgreens_library
     await seed_microgreens_library()
+    await load_catalog()
 
     start_scheduler()
+    analysis_queue.start_worker()
 
     yield
+    await stop_scheduler()
+    await analysis_queue.stop_worker()
+    image_variants.shutdown()
     print("Выключение")
 
 
 app = FastAPI(lifespan=lifespan)
 
 
-base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-static_dir = os.path.join(base_dir, "static")
-
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
+app.mount("/static", PhotoStaticFiles(directory=STATIC_DIR), name="static")
 
 app.add_middleware(AuthMiddleware)
+app.add_middleware(BodySizeLimitMiddleware, max_body_size=MAX_REQUEST_BODY)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["localhost:8081"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 app.include_router(user.router)
 app.include_router(push_token.router)
@@ -53,6 +61,8 @@ app.include_router(microgreen_library.router)
 app.include_router(entry.router)
 app.include_router(notification.router)
 app.include_router(analysis.router)
+app.include_router(growth.router)
+app.include_router(metrics.router)
 
 if __name__ == '__main__':
     uvicorn.run("main:app", reload=True)
@@ -0,0 +1,70 @@
+import math
+
+import numpy as np
+import pytest
+
+from data.baselines import bucket_deltas
+from service.baselines import Histogram
+
+
+def histogram(values, width):
+    # the same grouping load_histograms gets back from growth_baselines
+    rows = {}
+    for value in values:
+        row = rows.setdefault(math.floor(value / width), [0, 0.0])
+        row[0] += 1
+        row[1] += value
+    buckets = sorted(rows)
+    return Histogram(
+        buckets=np.array(buckets, dtype=np.int64),
+        counts=np.array([rows[bucket][0] for bucket in buckets], dtype=np.float64),
+        means=np.array([rows[bucket][1] / rows[bucket][0] for bucket in buckets], dtype=np.float64),
+        total=float(sum(values)),
+        width=width,
+    )
+
+
+@pytest.mark.parametrize("value, width", [(50.0, 2), (2.0, 0.5), (3.7, 0.5)])
+def test_identical_values(value, width):
+    baseline = histogram([value] * 100, width)
+
+    summary = baseline.summary()
+    assert summary.p10 == summary.p50 == summary.p90 == summary.mean == value
+    assert baseline.percentile_of(value) == 50.0
+
+
+def test_single_sample_day():
+    baseline = histogram([2.0], 0.5)
+
+    assert baseline.quantile(0.1) == baseline.quantile(0.9) == 2.0
+    assert baseline.percentile_of(2.0) == 50.0
+    assert baseline.percentile_of(1.0) == 0.0
+    assert baseline.percentile_of(3.0) == 100.0
+
+
+def test_quantiles_stay_within_seen_values():
+    values = [1.0, 2.0, 2.0, 3.0, 8.0]
+    baseline = histogram(values, 0.5)
+
+    quantiles = [baseline.quantile(q) for q in (0.0, 0.1, 0.5, 0.9, 1.0)]
+    assert quantiles == sorted(quantiles)
+    assert min(values) <= quantiles[0] and quantiles[-1] <= max(values)
+    assert baseline.quantile(0.5) == 2.0
+
+
+def test_percentile_of_is_mid_rank():
+    baseline = histogram([1.0, 2.0, 3.0, 4.0], 0.5)
+
+    assert [baseline.percentile_of(value) for value in (1.0, 2.0, 3.0, 4.0)] == [12.5, 37.5, 62.5, 87.5]
+    assert baseline.percentile_of(0.0) == 0.0
+    assert baseline.percentile_of(10.0) == 100.0
+
+
+def test_bucket_deltas_cancel_out():
+    from datetime import datetime
+
+    rows = [(1, datetime(2026, 1, 1), datetime(2026, 1, 3), 2.0, 50.0)]
+    added, removed = bucket_deltas(rows, 1), bucket_deltas(rows, -1)
+
+    assert added.keys() == removed.keys()
+    assert all(added[key][0] + removed[key][0] == 0 and added[key][1] + removed[key][1] == 0 for key in added)
@@ -0,0 +1,183 @@
+"""Several delivery workers against one SQLite file.
+
+data.config binds its engine to DATABASE_URL at import time, so every step runs in its own
+process: this file doubles as the worker script (see the __main__ block at the bottom).
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NOTIFICATIONS = 600
+WORKERS = 4
+
+
+def result_of(out: str):
+    # the app logs with print, so the result is the last line
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(db_path, *args, env=None, wait=True):
+    command = [sys.executable, "-W", "ignore", os.path.abspath(__file__), str(db_path), *map(str, args)]
+    process = subprocess.Popen(
+        command, cwd=ROOT, stdout=subprocess.PIPE, text=True,
+        env={**os.environ, "PYTHONPATH": ROOT, "DATABASE_URL": f"sqlite+aiosqlite:///{db_path}", **(env or {})},
+    )
+    if not wait:
+        return process
+    out, _ = process.communicate(timeout=120)
+    assert process.returncode == 0
+    return result_of(out)
+
+
+def run_workers(db_path, count, env=None):
+    processes = [run(db_path, "work", env=env, wait=False) for _ in range(count)]
+    results = []
+    for process in processes:
+        out, _ = process.communicate(timeout=120)
+        assert process.returncode == 0
+        results.append(result_of(out))
+    return results
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "push.sqlite"
+    run(path, "setup", NOTIFICATIONS)
+    return path
+
+
+def test_every_notification_is_sent_exactly_once(db_path):
+    results = run_workers(db_path, WORKERS)
+
+    sent = [number for result in results for number in result["sent"]]
+    assert sorted(sent) == list(range(NOTIFICATIONS))
+    assert run(db_path, "undelivered") == 0
+    # with batches far smaller than the backlog, the work is actually shared
+    assert sum(1 for result in results if result["sent"]) > 1
+
+
+def test_abandoned_lease_is_reclaimed(db_path):
+    lease = {"PUSH_LEASE_SECONDS": "1"}
+    abandoned = run(db_path, "claim", env=lease)
+    assert len(abandoned) == 50
+
+    results = run_workers(db_path, 2, env=lease)
+
+    sent = [number for result in results for number in result["sent"]]
+    assert sorted(sent) == list(range(NOTIFICATIONS))
+    assert set(abandoned) <= set(sent)
+    assert run(db_path, "undelivered") == 0
+
+
+def test_rejected_notifications_stop_being_sent(db_path):
+    # even numbers are rejected for good, odd ones are rate limited on every try
+    result = run(db_path, "reject", env={"PUSH_LEASE_SECONDS": "0", "PUSH_MAX_ATTEMPTS": "3"})
+
+    assert all(result["sends"][str(number)] == 1 for number in range(0, NOTIFICATIONS, 2))
+    assert all(result["sends"][str(number)] == 3 for number in range(1, NOTIFICATIONS, 2))
+    assert result["failed"] == NOTIFICATIONS // 2
+
+
+async def worker_main(mode: str, argument: str | None):
+    from datetime import datetime
+
+    from sqlalchemy import select, func
+
+    from data.config import new_session, seed_microgreens_library, UserOrm, LotOrm, NotificationOrm
+    from data.migrations import run_migrations
+    from service import push_scheduler
+
+    if mode == "setup":
+        await run_migrations()
+        await seed_microgreens_library()
+        async with new_session() as session:
+            user = UserOrm(email="lease@example.com", hashed_password="x", expo_push_token="ExponentPushToken[lease]")
+            session.add(user)
+            await session.flush()
+            lot = LotOrm(user_id=user.id, microgreen_id=1, sowing_date=datetime(2026, 1, 1), substrate_type="soil",
+                         expected_harvest_date=datetime(2026, 1, 9))
+            session.add(lot)
+            await session.flush()
+            session.add_all([
+                # the body is the notification's number, so the fake client can tell what it sent
+                NotificationOrm(lot_id=lot.id, message=str(number), scheduled_at=datetime(2026, 1, 1))
+                for number in range(int(argument))
+            ])
+            await session.commit()
+        return None
+
+    if mode == "undelivered":
+        async with new_session() as session:
+            result = await session.execute(
+                select(func.count()).select_from(NotificationOrm).where(NotificationOrm.is_delivered == False)
+            )
+            return result.scalar()
+
+    if mode == "claim":
+        # takes a batch and exits without sending or releasing it, like a worker killed mid-send
+        async with new_session() as session:
+            _, due = await push_scheduler.claim_due_notifications(session, datetime.utcnow())
+        return [int(body) for _, _, body in due]
+
+    import asyncio
+    import random
+    import time
+    from collections import Counter
+
+    from exponent_server_sdk import PushTicket
+
+    if mode == "reject":
+        sends = Counter()
+
+        class RejectingPushClient:
+            def publish_multiple(self, messages):
+                sends.update(message.body for message in messages)
+                return [
+                    PushTicket(message, PushTicket.ERROR_STATUS, "rejected", {
+                        "error": "MessageRateExceeded" if int(message.body) % 2 else "MessageTooBig"}, None)
+                    for message in messages
+                ]
+
+        push_scheduler.push_client = RejectingPushClient()
+        # more ticks than attempts, each one after every lease taken so far has expired
+        for _ in range(push_scheduler.PUSH_MAX_ATTEMPTS + 2):
+            await asyncio.sleep(0.01)
+            await push_scheduler.check_and_send_notifications()
+        async with new_session() as session:
+            result = await session.execute(
+                select(func.count()).select_from(NotificationOrm)
+                .where(NotificationOrm.delivery_error == "MessageTooBig")
+            )
+            return {"sends": sends, "failed": result.scalar()}
+
+    sent = []
+
+    class FakePushClient:
+        def publish_multiple(self, messages):
+            time.sleep(random.uniform(0.005, 0.02))
+            sent.extend(int(message.body) for message in messages)
+            return [PushTicket(message, PushTicket.SUCCESS_STATUS, "", None, None) for message in messages]
+
+    push_scheduler.push_client = FakePushClient()
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        await push_scheduler.check_and_send_notifications()
+        async with new_session() as session:
+            result = await session.execute(
+                select(func.count()).select_from(NotificationOrm).where(NotificationOrm.is_delivered == False)
+            )
+            if result.scalar() == 0:
+                break
+        await asyncio.sleep(0.05)
+    return {"sent": sent}
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    os.environ.setdefault("PUSH_BATCH_SIZE", "50")
+    print(json.dumps(asyncio.run(worker_main(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None))))
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import os
+import time
+
+from fastapi import HTTPException, status
+
+AI_PROVIDER = os.getenv("AI_PROVIDER", "g4f")
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "90"))
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", "5"))
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "60"))
+AI_STUB_LATENCY = float(os.getenv("AI_STUB_LATENCY", "0"))
+
+
+class G4FProvider:
+    name = "g4f"
+
+    def __init__(self):
+        self.client = None
+
+    async def complete(self, prompt: str, image: bytes) -> str:
+        # g4f pulls in every provider on import; load it on the first analysis, not on worker start
+        import g4f
+        from g4f.client import AsyncClient
+        from g4f.Provider.OIVSCode import OIVSCode
+
+        if self.client is None:
+            self.client = AsyncClient(provider=OIVSCode)
+        response = await self.client.chat.completions.create(
+            model=g4f.models.default,
+            messages=[{"role": "user", "content": prompt}],
+            image=image
+        )
+        return response.choices[0].message.content
+
+
+class StubProvider:
+    # answers offline in the shape the prompt asks for, same inputs -> same text; for load tests and local runs
+    name = "stub"
+
+    async def complete(self, prompt: str, image: bytes) -> str:
+        if AI_STUB_LATENCY:
+            await asyncio.sleep(AI_STUB_LATENCY)
+        digest = hashlib.sha256(prompt.encode() + image).hexdigest()[:12]
+        sections = ["Динамика роста", "Влажность", "Общее состояние растения", "Рекомендации по уходу",
+                    "Прогноз на сбор урожая"]
+        return "\n\n".join(f"{number}. {section}: тестовый ответ {digest}"
+                           for number, section in enumerate(sections, start=1))
+
+
+PROVIDERS = {provider.name: provider for provider in (G4FProvider, StubProvider)}
+
+
+class CircuitBreaker:
+    # after `threshold` failures in a row calls fail fast for `cooldown` seconds, then one trial call is let through
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> tuple[bool, bool]:
+        # (allowed, trial): trial is True only for the one call let through while half-open
+        state = self.state
+        if state == "closed":
+            return True, False
+        if state == "half-open" and not self.trial_running:
+            self.trial_running = True
+            return True, True
+        return False, False
+
+    def record_success(self, trial: bool = False):
+        self.failures = 0
+        self.opened_at = None
+        if trial:
+            self.trial_running = False
+
+    def record_failure(self, trial: bool = False):
+        self.failures += 1
+        if trial or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        if trial:
+            self.trial_running = False
+
+    def release_trial(self, trial: bool):
+        # the trial call ended without telling us anything about the provider
+        if trial:
+            self.trial_running = False
+
+
+provider = PROVIDERS[AI_PROVIDER]()
+breaker = CircuitBreaker(AI_BREAKER_THRESHOLD, AI_BREAKER_COOLDOWN)
+slots = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+
+stats = {"pending": 0, "completed": 0, "failed": 0, "timed_out": 0, "rejected": 0}
+
+
+def get_stats() -> dict:
+    return {**stats, "provider": provider.name, "breaker": breaker.state, "max_concurrency": AI_MAX_CONCURRENCY}
+
+
+def read_image(path: str) -> bytes:
+    with open(path, "rb") as image:
+        return image.read()
+
+
+async def complete(prompt: str, image_path: str) -> str:
+    # read (and close) the photo before touching the breaker: a missing file is not a provider outage
+    image = await asyncio.to_thread(read_image, image_path)
+    allowed, trial = breaker.allow()
+    if not allowed:
+        stats["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Analysis provider is unavailable, try again later"
+        )
+
+    stats["pending"] += 1
+    try:
+        async with slots:
+            response = await asyncio.wait_for(provider.complete(prompt, image), timeout=AI_TIMEOUT)
+    except asyncio.TimeoutError:
+        stats["timed_out"] += 1
+        breaker.record_failure(trial)
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Analysis provider timed out")
+    except asyncio.CancelledError:
+        # not the provider's fault; don't hold the half-open trial forever
+        breaker.release_trial(trial)
+        raise
+    except Exception as e:
+        stats["failed"] += 1
+        breaker.record_failure(trial)
+        print(f"Analysis provider error: {e}")
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Analysis provider failed")
+    finally:
+        stats["pending"] -= 1
+
+    breaker.record_success(trial)
+    stats["completed"] += 1
+    return response
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def bucket_edges(n: int, threshold: int) -> np.ndarray:
+    # threshold - 2 buckets between the fixed first and last point
+    return np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: keeps first and last point, and from every bucket in between the point
+    # forming the largest triangle with the previously kept point and the average of the next bucket
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = bucket_edges(n, threshold)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        if next_end <= next_start:
+            next_end = next_start + 1
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def bucket_envelope(y: np.ndarray, selected: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # min/max over the bucket each kept point was picked from, so spikes LTTB dropped still show up
+    if len(selected) == len(y):
+        return y, y
+    starts = selected.copy()
+    starts[1:-1] = bucket_edges(len(y), len(selected))[:-1]
+    return np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)
@@ -0,0 +1,51 @@
+import uuid
+
+from fastapi import FastAPI
+
+# Local stand-in for the Expo push API, so delivery and receipt handling can run without the network:
+#   uvicorn tools.fake_expo:app --port 8765
+#   EXPO_HOST=http://127.0.0.1:8765 PUSH_RECEIPT_DELAY_MINUTES=0 uvicorn src.main:app
+# tokens containing "invalid" are rejected at send time, tokens containing "dead" are accepted but
+# come back as DeviceNotRegistered in their receipt, anything else is delivered.
+
+app = FastAPI()
+
+messages: list[dict] = []
+receipts: dict[str, dict] = {}
+stats = {"send_requests": 0, "receipt_requests": 0}
+
+
+def not_registered(token: str) -> dict:
+    return {
+        "status": "error",
+        "message": f"{token} is not a registered push notification recipient",
+        "details": {"error": "DeviceNotRegistered"},
+    }
+
+
+@app.post("/--/api/v2/push/send")
+async def send(payload: list[dict] | dict):
+    stats["send_requests"] += 1
+    batch = payload if isinstance(payload, list) else [payload]
+    tickets = []
+    for message in batch:
+        token = message.get("to", "")
+        messages.append(message)
+        if "invalid" in token:
+            tickets.append(not_registered(token))
+            continue
+        ticket_id = str(uuid.uuid4())
+        receipts[ticket_id] = not_registered(token) if "dead" in token else {"status": "ok"}
+        tickets.append({"status": "ok", "id": ticket_id})
+    return {"data": tickets}
+
+
+@app.post("/--/api/v2/push/getReceipts")
+async def get_receipts(payload: dict):
+    stats["receipt_requests"] += 1
+    return {"data": {ticket_id: receipts[ticket_id] for ticket_id in payload.get("ids", []) if ticket_id in receipts}}
+
+
+@app.get("/messages")
+async def get_messages():
+    return {"messages": messages, **stats}
@@ -0,0 +1,72 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from data.config import photo_file_path
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# name -> longest side in pixels
+VARIANTS = {"thumb": 320, "medium": 1280}
+VARIANT_QUALITY = int(os.getenv("VARIANT_QUALITY", "80"))
+
+executor: ProcessPoolExecutor | None = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global executor
+    if executor is None:
+        # spawn, not fork: the parent has aiosqlite and bcrypt threads running
+        executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return executor
+
+
+def variant_url(photo_url: str, name: str) -> str:
+    return f"{os.path.splitext(photo_url)[0]}_{name}.webp"
+
+
+def render_variants(source_path: str) -> list[str]:
+    # runs in a worker process; Pillow decoding and resizing is CPU bound
+    from PIL import Image, ImageOps
+
+    stem = os.path.splitext(source_path)[0]
+    written = []
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for name, size in VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail((size, size))
+            path = f"{stem}_{name}.webp"
+            try:
+                # content-addressed original, so an existing variant is already correct; touched so a
+                # pending cleanup (tools.photo_cleanup) keeps it
+                os.utime(path)
+                written.append(name)
+                continue
+            except FileNotFoundError:
+                pass
+            temp_path = f"{path}.part"
+            variant.save(temp_path, "WEBP", quality=VARIANT_QUALITY)
+            os.replace(temp_path, path)
+            written.append(name)
+    return written
+
+
+async def create_variants(photo_url: str) -> dict:
+    try:
+        written = await asyncio.get_running_loop().run_in_executor(
+            get_executor(), render_variants, photo_file_path(photo_url)
+        )
+    except Exception as e:
+        # e.g. HEIC without a Pillow plugin: the entry keeps only its original photo
+        print(f"Error creating photo variants for {photo_url}: {e}")
+        return {}
+    return {
+        "thumbnail_url": variant_url(photo_url, "thumb") if "thumb" in written else None,
+        "medium_url": variant_url(photo_url, "medium") if "medium" in written else None,
+    }
+
+
+def shutdown():
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
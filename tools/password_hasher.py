@@ -0,0 +1,65 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException, status
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "64"))
+
+# bcrypt releases the GIL, so a small thread pool keeps it off the event loop
+executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+
+stats = {"pending": 0, "max_pending": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+
+def get_stats() -> dict:
+    return {**stats, "queued": max(stats["pending"] - BCRYPT_WORKERS, 0), "workers": BCRYPT_WORKERS}
+
+
+async def run_in_pool(func, *args):
+    if stats["pending"] >= BCRYPT_MAX_PENDING:
+        stats["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again later"
+        )
+    stats["pending"] += 1
+    stats["max_pending"] = max(stats["max_pending"], stats["pending"])
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    except BaseException:
+        # bcrypt errors and callers cancelled while waiting
+        stats["failed"] += 1
+        raise
+    finally:
+        stats["pending"] -= 1
+    stats["completed"] += 1
+    return result
+
+
+def _hash(password: str) -> str:
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def _check(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+async def hash_password(password: str) -> str:
+    return await run_in_pool(_hash, password)
+
+
+async def check_password(password: str, hashed_password: str) -> bool:
+    return await run_in_pool(_check, password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
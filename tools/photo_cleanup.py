@@ -0,0 +1,82 @@
+import asyncio
+import os
+import time
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from data.config import new_session, photo_file_path, EntryOrm
+from tools.image_variants import VARIANTS, variant_url
+
+# keep references so pending removals are not garbage-collected mid-flight
+pending_tasks: set = set()
+
+REFERENCE_CHECK_BATCH = 500
+# a file stored or reused this recently may belong to an entry whose row isn't committed yet;
+# it is left in place and checked again once this has passed
+PHOTO_REMOVAL_GRACE_SECONDS = int(os.getenv("PHOTO_REMOVAL_GRACE_SECONDS", "60"))
+
+
+def remove_files(paths: list[str], unused_since: float) -> bool:
+    # returns whether any file turned out to be in use again and was kept
+    kept = False
+    for path in paths:
+        # moved aside first: an upload of the same bytes either touched it before (and it goes back)
+        # or finds nothing and stores it again
+        removing_path = f"{path}.{uuid.uuid4().hex}.removing"
+        try:
+            os.rename(path, removing_path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            print(f"Error removing photo {path}: {e}")
+            continue
+        try:
+            if os.path.getmtime(removing_path) >= unused_since:
+                os.replace(removing_path, path)
+                kept = True
+            else:
+                os.remove(removing_path)
+        except OSError as e:
+            print(f"Error removing photo {path}: {e}")
+    return kept
+
+
+def photo_paths(photo_url: str) -> list[str]:
+    return [photo_file_path(photo_url)] + [photo_file_path(variant_url(photo_url, name)) for name in VARIANTS]
+
+
+def remove_photos(photo_urls: list[str], unused_since: float) -> list[str]:
+    return [photo_url for photo_url in photo_urls if remove_files(photo_paths(photo_url), unused_since)]
+
+
+async def remove_later(photo_urls: list[str], unused_since: float):
+    kept = await asyncio.to_thread(remove_photos, photo_urls, unused_since)
+    if kept:
+        await asyncio.sleep(PHOTO_REMOVAL_GRACE_SECONDS + 1)
+        async with new_session() as session:
+            await remove_unreferenced(session, kept)
+
+
+def schedule_removal(photo_urls: list[str], unused_since: float | None = None):
+    photo_urls = [photo_url for photo_url in photo_urls if photo_url]
+    if not photo_urls:
+        return
+    if unused_since is None:
+        unused_since = time.time() - PHOTO_REMOVAL_GRACE_SECONDS
+    task = asyncio.get_running_loop().create_task(remove_later(photo_urls, unused_since))
+    pending_tasks.add(task)
+    task.add_done_callback(pending_tasks.discard)
+
+
+async def remove_unreferenced(session: AsyncSession, photo_urls: list[str]):
+    # photos are content-addressed, so another entry may still point at the same file
+    unused_since = time.time() - PHOTO_REMOVAL_GRACE_SECONDS
+    candidates = list({photo_url for photo_url in photo_urls if photo_url})
+    still_used = set()
+    for start in range(0, len(candidates), REFERENCE_CHECK_BATCH):
+        batch = candidates[start:start + REFERENCE_CHECK_BATCH]
+        result = await session.execute(select(EntryOrm.photo_url).where(EntryOrm.photo_url.in_(batch)).distinct())
+        still_used.update(result.scalars().all())
+    schedule_removal([photo_url for photo_url in candidates if photo_url not in still_used], unused_since)
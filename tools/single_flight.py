@@ -0,0 +1,31 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    # concurrent callers with the same key share one execution instead of each running their own
+    def __init__(self):
+        self.flights: dict[Hashable, asyncio.Task] = {}
+        self.stats = {"calls": 0, "executed": 0, "coalesced": 0, "failed": 0}
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "in_flight": len(self.flights)}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats["calls"] += 1
+        task = self.flights.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["executed"] += 1
+            # a task of its own, so one caller being cancelled doesn't cancel the work for the others
+            task = asyncio.create_task(func())
+            self.flights[key] = task
+            task.add_done_callback(lambda done: self.finish(key, done))
+        return await asyncio.shield(task)
+
+    def finish(self, key: Hashable, task: asyncio.Task):
+        if self.flights.get(key) is task:
+            del self.flights[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["failed"] += 1
@@ -0,0 +1,14 @@
+from fastapi.staticfiles import StaticFiles
+from starlette.types import Scope
+
+# entry photos and their variants are never rewritten in place, so clients may keep them forever
+IMMUTABLE_PREFIX = "images/entries/"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class PhotoStaticFiles(StaticFiles):
+    async def get_response(self, path: str, scope: Scope):
+        response = await super().get_response(path, scope)
+        if path.replace("\\", "/").startswith(IMMUTABLE_PREFIX) and response.status_code in (200, 206, 304):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
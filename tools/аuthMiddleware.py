@@ -1,39 +1,55 @@
-from fastapi import Request, HTTPException, status
+import re
+from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.security.utils import get_authorization_scheme_param
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from data.config import new_session
 from service import user as user_service
-import jwt
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="user/login")
 
+PUBLIC_PATHS = ("/user/login", "/user/register", "/docs", "/openapi.json")
+PUBLIC_PREFIXES = ("/static/",)
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        public_paths = ["/user/login", "/user/register", "/docs", "/openapi.json"]
 
-        if request.method == "OPTIONS" or request.url.path in public_paths:
-            return await call_next(request)
+def compile_public_matcher(paths: tuple = PUBLIC_PATHS, prefixes: tuple = PUBLIC_PREFIXES):
+    pattern = "|".join([re.escape(path) + r"\Z" for path in paths] + [re.escape(prefix) for prefix in prefixes])
+    return re.compile(pattern).match
+
+
+class AuthMiddleware:
+    # plain ASGI: no extra task or body stream per response, so /static files are streamed untouched
+    def __init__(self, app: ASGIApp, public_paths: tuple = PUBLIC_PATHS, public_prefixes: tuple = PUBLIC_PREFIXES):
+        self.app = app
+        self.is_public = compile_public_matcher(public_paths, public_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or self.is_public(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        authorization = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value.decode("latin-1")
+                break
+        scheme, token = get_authorization_scheme_param(authorization)
 
         try:
-            token = await oauth2_scheme(request)
-            user = await user_service.verify_token(token)
-
-            if user is None:
-                return JSONResponse(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    content={"detail": "Invalid Token..."}
-                )
-        except jwt.ExpiredSignatureError:
-            return JSONResponse(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                content={"detail": "Token has expired"},
-            )
+            if not authorization or scheme.lower() != "bearer":
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+            async with new_session() as session:
+                # writes skip the cached id if the account behind it has changed
+                user_id = await user_service.verify_token_user_id(session, token,
+                                                                  verify=scope["method"] not in ("GET", "HEAD"))
         except HTTPException:
-            return JSONResponse(
+            response = JSONResponse(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 content={"detail": "Invalid Token..."}
             )
+            await response(scope, receive, send)
+            return
 
-        response = await call_next(request)
-        return response
+        scope.setdefault("state", {})["user_id"] = user_id
+        await self.app(scope, receive, send)
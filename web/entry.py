@@ -1,12 +1,16 @@
 from datetime import datetime
 
-from fastapi import APIRouter, status, security, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, status, security, Depends, HTTPException, UploadFile, File, Form, Request, Query
 
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from data.config import get_session
 from models.entry import EntryCreate, EntryRead
 from typing import List
 from service import entry as service
-from service.lot import get_lot_detail
-from web.helpers import get_current_user_id
+from service.lot import check_lot_owner
+from web.helpers import get_current_user_id, conditional_response, encode_cursor, decode_cursor, \
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 router = APIRouter(prefix="/lots", tags=["Entries"])
 
@@ -24,16 +28,11 @@ async def create_entry_endpoint(
         height: float = Form(...),
         moisture: float = Form(...),
         photo: UploadFile = File(...),
-        current_user_id: int = Depends(get_current_user_id)
+        current_user_id: int = Depends(get_current_user_id),
+        session: AsyncSession = Depends(get_session)
 ) -> EntryRead:
-    lot = await get_lot_detail(lot_id)
-    if not lot:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lot not found")
-    if lot.user_id != current_user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not allowed to add an entry to this lot"
-        )
+    await check_lot_owner(session, lot_id, current_user_id, "You are not allowed to add an entry to this lot",
+                          verify=True)
     photo_url = await service.save_photo(photo)
 
     entry_data = {
@@ -46,11 +45,26 @@ async def create_entry_endpoint(
     from models.entry import EntryCreate
     entry_obj = EntryCreate.parse_obj(entry_data)
 
-    created_entry = await service.create_entry(entry_obj, lot_id, photo_url)
+    created_entry = await service.create_entry(session, entry_obj, lot_id, photo_url)
     return created_entry
 
 
 @router.get("/{lot_id}/entries",  status_code=status.HTTP_200_OK)
-async def get_entries(lot_id: int) -> List[EntryRead] | None:
-    fetched_entries = await service.get_entries(lot_id)
-    return fetched_entries
+async def get_entries(request: Request, lot_id: int,
+                      limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      cursor: str | None = None,
+                      since: datetime | None = None,
+                      until: datetime | None = None,
+                      session: AsyncSession = Depends(get_session)) -> List[EntryRead] | None:
+    after = None
+    if cursor:
+        entry_date, entry_id = decode_cursor(cursor, 2)
+        try:
+            after = (datetime.fromisoformat(entry_date), int(entry_id))
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    fetched_entries = await service.get_entries(session, lot_id, limit, after, since, until)
+    next_cursor = None
+    if fetched_entries and len(fetched_entries) == limit:
+        next_cursor = encode_cursor(fetched_entries[-1].entry_date.isoformat(), fetched_entries[-1].id)
+    return conditional_response(request, fetched_entries, next_cursor)
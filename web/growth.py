@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from fastapi import APIRouter, status, Depends, Request, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from data.config import get_session
+from models.growth import GrowthReport, GrowthSeriesResponse
+from web.helpers import get_current_user_id, conditional_response, MAX_PAGE_SIZE
+from service import growth as service
+
+router = APIRouter(prefix="/lots", tags=["Growth"])
+
+
+@router.get("/{lot_id}/growth", response_model=GrowthReport, status_code=status.HTTP_200_OK)
+async def get_growth_report(lot_id: int,
+                            user_id: int = Depends(get_current_user_id),
+                            session: AsyncSession = Depends(get_session)):
+    return await service.get_growth_report(session, lot_id, user_id)
+
+
+@router.get("/{lot_id}/series", response_model=GrowthSeriesResponse, status_code=status.HTTP_200_OK)
+async def get_growth_series(request: Request, lot_id: int,
+                            points: int = Query(100, ge=3, le=MAX_PAGE_SIZE),
+                            since: datetime | None = None,
+                            until: datetime | None = None,
+                            user_id: int = Depends(get_current_user_id),
+                            session: AsyncSession = Depends(get_session)):
+    series = await service.get_downsampled_series(session, lot_id, user_id, points, since, until)
+    return conditional_response(request, series)
@@ -1,15 +1,67 @@
-from fastapi import HTTPException
+import base64
+import binascii
+import hashlib
+import json
+
+from fastapi import Request, Response, HTTPException, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.params import Depends
-from fastapi import HTTPException, status
-from service.user import verify_token
+from sqlalchemy.ext.asyncio import AsyncSession
+from data.config import get_session
+from service.user import verify_token_user_id
 from tools.аuthMiddleware import oauth2_scheme
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+async def get_current_user_id(request: Request, token: str = Depends(oauth2_scheme),
+                              session: AsyncSession = Depends(get_session)) -> int:
+    # AuthMiddleware has already verified the token for this request
+    user_id = getattr(request.state, "user_id", None)
+    if user_id is not None:
+        return user_id
+    return await verify_token_user_id(session, token)
+
+
+def encode_cursor(*values) -> str:
+    raw = "|".join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, parts: int) -> list[str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    values = raw.split("|")
+    if len(values) != parts:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
+
+
+def decode_id_cursor(cursor: str) -> int:
+    value = decode_cursor(cursor, 1)[0]
+    if not value.isdigit():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return int(value)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
 
-async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
-    user = await verify_token(token)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid credentials"
-        )
-    return int(user.id)
\ No newline at end of file
+def conditional_response(request: Request, content, next_cursor: str | None = None) -> Response:
+    # serialize once, hash the bytes for the ETag and answer 304 when the client already has them
+    body = json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
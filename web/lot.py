@@ -1,29 +1,46 @@
 from sys import prefix
 
-from fastapi import APIRouter, status, HTTPException
+from datetime import datetime
+
+from fastapi import APIRouter, status, HTTPException, Request, Query
 from fastapi.params import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
+from data.config import get_session
+
 from models.lot import LotCreate, LotCreateResponse, LotsGetResponse, LotDetailResponse
 from service import lot as lot_service
 from service import entry as entry_service
+from service import microgreen_library as microgreen_service
 from service.entry import delete_entry
-from web.helpers import get_current_user_id
+from web.helpers import get_current_user_id, conditional_response, encode_cursor, decode_id_cursor, \
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 router = APIRouter(prefix="/lots", tags=["Lots"])
 
 
 @router.post("/", response_model=LotCreateResponse, status_code=status.HTTP_201_CREATED)
-async def create_lot(lot: LotCreate, user_id: int = Depends(get_current_user_id)):
-    lot = await lot_service.create_lot(lot_data=lot, user_id=user_id)
+async def create_lot(lot: LotCreate, user_id: int = Depends(get_current_user_id),
+                     session: AsyncSession = Depends(get_session)):
+    lot = await lot_service.create_lot(session, lot_data=lot, user_id=user_id)
     return LotCreateResponse(id=lot.id)
 
 
 @router.get("/", response_model=List[LotsGetResponse], status_code=status.HTTP_200_OK)
-async def get_all_lots(current_user_id: int = Depends(get_current_user_id)):
-    lots = await lot_service.get_lots(current_user_id)
+async def get_all_lots(request: Request,
+                       limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       cursor: str | None = None,
+                       since: datetime | None = None,
+                       until: datetime | None = None,
+                       current_user_id: int = Depends(get_current_user_id),
+                       session: AsyncSession = Depends(get_session)):
+    after_id = decode_id_cursor(cursor) if cursor else None
+    lots = await lot_service.get_lots(session, current_user_id, limit, after_id, since, until)
+    catalog = await microgreen_service.get_catalog(session)
     response = []
     for lot in lots:
+        microgreen = catalog.by_id.get(lot.microgreen_id)
         response.append(LotsGetResponse(
             id=lot.id,
             user_id=lot.user_id,
@@ -32,18 +49,23 @@ async def get_all_lots(current_user_id: int = Depends(get_current_user_id)):
             substrate_type=lot.substrate_type,
             expected_harvest_date=lot.expected_harvest_date,
             created_at=lot.created_at,
-            avatar_url=lot.microgreen.avatar if lot.microgreen else ""
+            avatar_url=microgreen.avatar if microgreen else ""
         ))
-    return response
+    next_cursor = encode_cursor(lots[-1].id) if len(lots) == limit else None
+    return conditional_response(request, response, next_cursor)
 
 
 @router.get("/{lot_id}", response_model=LotDetailResponse, status_code=status.HTTP_200_OK)
-async def get_lot_detail_endpoint(lot_id: int, current_user_id: int = Depends(get_current_user_id)):
-    lot = await lot_service.get_lot_detail(lot_id)
+async def get_lot_detail_endpoint(request: Request, lot_id: int,
+                                  entries_limit: int = Query(20, ge=0, le=MAX_PAGE_SIZE),
+                                  current_user_id: int = Depends(get_current_user_id),
+                                  session: AsyncSession = Depends(get_session)):
+    lot = await lot_service.get_lot_detail(session, lot_id)
     if not lot:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Lot not found")
     if lot.user_id != current_user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to access this lot")
+    microgreen = (await microgreen_service.get_catalog(session)).by_id.get(lot.microgreen_id)
 
     lot_data = {
         "id": lot.id,
@@ -53,22 +75,25 @@ async def get_lot_detail_endpoint(lot_id: int, current_user_id: int = Depends(ge
         "substrate_type": lot.substrate_type,
         "expected_harvest_date": lot.expected_harvest_date,
         "created_at": lot.created_at,
-        "avatar_url": lot.microgreen.avatar if lot.microgreen else "",
-        "entries": lot.entries
+        "avatar_url": microgreen.avatar if microgreen else "",
+        # only the latest entries; the full journal is paged through GET /lots/{lot_id}/entries
+        "entries": await entry_service.get_latest_entries(session, lot_id, entries_limit) if entries_limit else []
     }
-    return lot_data
+    return conditional_response(request, LotDetailResponse(**lot_data))
 
 
 @router.delete("/{lot_id}", status_code=status.HTTP_200_OK)
 async def delete_lot(lot_id: int,
-                            user_id: int = Depends(get_current_user_id)) -> dict | None:
-    deleted_lot = await lot_service.delete_lot(lot_id, user_id)
+                            user_id: int = Depends(get_current_user_id),
+                            session: AsyncSession = Depends(get_session)) -> dict | None:
+    deleted_lot = await lot_service.delete_lot(session, lot_id, user_id)
     return deleted_lot
 
 
 @router.delete("/{lot_id}/entry/{entry_id}", status_code=status.HTTP_200_OK)
 async def delete_notification(lot_id: int, entry_id: int,
-                              user_id: int = Depends(get_current_user_id)) -> dict | None:
-    deleted_entry = await entry_service.delete_entry(lot_id, entry_id, user_id)
+                              user_id: int = Depends(get_current_user_id),
+                              session: AsyncSession = Depends(get_session)) -> dict | None:
+    deleted_entry = await entry_service.delete_entry(session, lot_id, entry_id, user_id)
     return deleted_entry
 
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, status
+
+from service import analysis
+from tools import password_hasher, ai_client
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@router.get("", status_code=status.HTTP_200_OK)
+async def get_metrics() -> dict:
+    # counters of the worker process that answers, since it started
+    return {
+        "analysis_flights": analysis.flights.get_stats(),
+        "password_hasher": password_hasher.get_stats(),
+        "ai_client": ai_client.get_stats(),
+    }
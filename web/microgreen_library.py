@@ -1,13 +1,28 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, status, Depends, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
+from data.config import get_session
 from models.microgreen_library import MicrogreenRead
+from models.baseline import MicrogreenBaseline
 
 from service import microgreen_library as service
+from service import baselines as baseline_service
+from web.helpers import etag_matches
 
 router = APIRouter(prefix="/microgreens", tags=["Microgreen_library"])
 
+CATALOG_CACHE_CONTROL = "public, max-age=3600"
 
-@router.get("", status_code=status.HTTP_200_OK)
-async def get_microgreens() -> List[MicrogreenRead] | None:
-    fetched_microgreens = await service.get_microgreens()
-    return fetched_microgreens
+
+@router.get("", status_code=status.HTTP_200_OK, response_model=List[MicrogreenRead])
+async def get_microgreens(request: Request, session: AsyncSession = Depends(get_session)) -> Response:
+    catalog = await service.get_catalog(session)
+    headers = {"ETag": catalog.etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+    if etag_matches(request, catalog.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=catalog.body, media_type="application/json", headers=headers)
+
+
+@router.get("/{microgreen_id}/baseline", status_code=status.HTTP_200_OK, response_model=MicrogreenBaseline)
+async def get_microgreen_baseline(microgreen_id: int, session: AsyncSession = Depends(get_session)):
+    return await baseline_service.get_baseline(session, microgreen_id)
@@ -1,7 +1,12 @@
-from fastapi import APIRouter, status, Depends
+from datetime import datetime
+
+from fastapi import APIRouter, status, Depends, Request, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
+from data.config import get_session
 from models.notification import CreateNotification, ReadNotification
-from web.helpers import get_current_user_id
+from web.helpers import get_current_user_id, conditional_response, encode_cursor, decode_id_cursor, \
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from service import notification as service
 
 router = APIRouter(prefix="/lots", tags=["Notifications"])
@@ -9,19 +14,29 @@ router = APIRouter(prefix="/lots", tags=["Notifications"])
 
 @router.post("/{lot_id}/notification", status_code=status.HTTP_201_CREATED)
 async def create_notification(notif: CreateNotification, lot_id: int,
-                              user_id: int = Depends(get_current_user_id)) -> ReadNotification | None:
-    created_notification = await service.create_notification(notif, lot_id, user_id)
+                              user_id: int = Depends(get_current_user_id),
+                              session: AsyncSession = Depends(get_session)) -> ReadNotification | None:
+    created_notification = await service.create_notification(session, notif, lot_id, user_id)
     return created_notification
 
 
 @router.get("/{lot_id}/notifications", status_code=status.HTTP_200_OK)
-async def get_notifications(lot_id: int, user_id: int = Depends(get_current_user_id)) -> List[ReadNotification] | None:
-    fetched_notification = await service.get_notifications(lot_id, user_id)
-    return fetched_notification
+async def get_notifications(request: Request, lot_id: int,
+                            limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                            cursor: str | None = None,
+                            since: datetime | None = None,
+                            until: datetime | None = None,
+                            user_id: int = Depends(get_current_user_id),
+                            session: AsyncSession = Depends(get_session)) -> List[ReadNotification] | None:
+    after_id = decode_id_cursor(cursor) if cursor else None
+    fetched_notification = await service.get_notifications(session, lot_id, user_id, limit, after_id, since, until)
+    next_cursor = encode_cursor(fetched_notification[-1].id) if len(fetched_notification) == limit else None
+    return conditional_response(request, fetched_notification, next_cursor)
 
 
 @router.delete("/{lot_id}/notifications/{notification_id}", status_code=status.HTTP_200_OK)
 async def delete_notification(lot_id: int, notification_id: int,
-                              user_id: int = Depends(get_current_user_id)) -> dict | None:
-    deleted_notification = await service.delete_notification(lot_id, notification_id, user_id)
+                              user_id: int = Depends(get_current_user_id),
+                              session: AsyncSession = Depends(get_session)) -> dict | None:
+    deleted_notification = await service.delete_notification(session, lot_id, notification_id, user_id)
     return deleted_notification
@@ -1,4 +1,7 @@
 from fastapi import APIRouter, status, security, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from data.config import get_session
 
 from models.user import LoginRequest, User, Password
 
@@ -10,24 +13,25 @@ oauth2schema = security.OAuth2PasswordBearer(tokenUrl="user/login")
 
 
 @router.post("/login")
-async def login(user: LoginRequest) -> dict:
-    token = await user_service.login(user)
+async def login(user: LoginRequest, session: AsyncSession = Depends(get_session)) -> dict:
+    token = await user_service.login(session, user)
     return token
 
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-async def register(user: LoginRequest) -> User:
-    user_data = await user_service.register(user)
+async def register(user: LoginRequest, session: AsyncSession = Depends(get_session)) -> User:
+    user_data = await user_service.register(session, user)
     return user_data
 
 
 @router.delete("/delete", status_code=status.HTTP_200_OK)
-async def delete(password: Password, token: str = Depends(oauth2schema)) -> dict:
-    result = await user_service.delete(password, token)
+async def delete(password: Password, token: str = Depends(oauth2schema),
+                 session: AsyncSession = Depends(get_session)) -> dict:
+    result = await user_service.delete(session, password, token)
     return result
 
 
 @router.get("/me", status_code=status.HTTP_200_OK)
-async def me(token: str = Depends(oauth2schema)) -> dict:
-    result = await user_service.checkme(token)
+async def me(token: str = Depends(oauth2schema), session: AsyncSession = Depends(get_session)) -> dict:
+    result = await user_service.checkme(session, token)
     return result